@@ -0,0 +1,86 @@
+"""
+Compares receiving from many synchronous sockets with a single `Reactor` thread against one blocking thread per
+socket. The numbers depend on the machine, so this is not part of the test suite; run it with `invoke benchmark`.
+"""
+
+import argparse
+import threading
+import time
+import zmq
+
+from hedgehog.utils.zmq import Context
+
+
+def make_pairs(ctx, name, sockets, messages):
+    pairs = []
+    for i in range(sockets):
+        a = ctx.socket(zmq.PUSH).configure(hwm=messages + 1, linger=0)
+        b = ctx.socket(zmq.PULL).configure(hwm=messages + 1, linger=0)
+        a.bind(f'inproc://{name}-{i}')
+        b.connect(f'inproc://{name}-{i}')
+        for _ in range(messages):
+            a.send_multipart((b'foo', b'bar'))
+        pairs.append((a, b))
+    return pairs
+
+
+def with_reactor(ctx, pairs, messages):
+    received = 0
+    total = len(pairs) * messages
+
+    def handler(frames):
+        nonlocal received
+        received += 1
+        if received == total:
+            reactor.stop()
+
+    with ctx.reactor() as reactor:
+        for _, b in pairs:
+            reactor.register(b, handler)
+        reactor.run()
+    return received
+
+
+def with_threads(ctx, pairs, messages):
+    received = [0] * len(pairs)
+
+    def worker(i, socket):
+        for _ in range(messages):
+            socket.recv_multipart()
+            received[i] += 1
+
+    threads = [threading.Thread(target=worker, args=(i, b)) for i, (_, b) in enumerate(pairs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(received)
+
+
+def measure(ctx, run, name, sockets, messages):
+    pairs = make_pairs(ctx, name, sockets, messages)
+    try:
+        begin = time.perf_counter()
+        assert run(ctx, pairs, messages) == sockets * messages
+        return time.perf_counter() - begin
+    finally:
+        for a, b in pairs:
+            a.close()
+            b.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sockets', type=int, default=8)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with Context() as ctx:
+        for name, run in (('reactor', with_reactor), ('thread per socket', with_threads)):
+            best = min(measure(ctx, run, f'{name}-{i}', args.sockets, args.messages) for i in range(args.repeat))
+            print(f"{name}: {best:.4f}s for {args.sockets} x {args.messages} messages")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,19 @@
-from typing import Callable, Dict, TypeVar
+from typing import Any, Callable, Dict, TypeVar
+import importlib
 from itertools import zip_longest
 
 __all__ = ['expect', 'expect_all', 'coroutine', 'SimpleDecorator', 'Registry']
 
+# subpackages pull in optional dependencies (zmq, protobuf, aiostream, trio, pytest),
+# so they are only imported when accessed as an attribute or imported explicitly
+_LAZY_SUBMODULES = {'asyncio', 'protobuf', 'test_utils', 'trio', 'zmq'}
+
+
+def __getattr__(name: str) -> Any:
+    if name in _LAZY_SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 def expect(a, b):
     """\
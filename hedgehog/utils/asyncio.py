@@ -1,7 +1,7 @@
-from typing import cast, Any, AsyncIterator, Awaitable, Callable, TypeVar, Union
+from typing import cast, Any, AsyncIterator, Awaitable, Callable, Dict, TypeVar, Union
 
 import asyncio
-from aiostream import operator, stream
+from functools import lru_cache
 
 __all__ = ['repeat_func', 'repeat_func_eof', 'stream_from_queue']
 
@@ -11,7 +11,25 @@ __DEFAULT = object()
 T = TypeVar('T')
 
 
-@operator
+@lru_cache(maxsize=None)
+def _operators() -> Dict[str, Any]:
+    # aiostream is only imported once one of its operators is actually used
+    from aiostream import operator, stream
+
+    @operator
+    def repeat_func(func: Callable[[], Union[T, Awaitable[T]]], times: int=None, *, interval: float=0) -> AsyncIterator[T]:
+        base = stream.repeat.raw((), times, interval=interval)
+        return cast(AsyncIterator[T], stream.starmap.raw(base, func, task_limit=1))
+
+    @operator
+    def repeat_func_eof(func: Callable[[], Union[T, Awaitable[T]]], eof: Any, *, interval: float=0, use_is: bool=False) -> AsyncIterator[T]:
+        pred = (lambda item: item != eof) if not use_is else (lambda item: (item is not eof))
+        base = repeat_func.raw(func, interval=interval)
+        return cast(AsyncIterator[T], stream.takewhile.raw(base, pred))
+
+    return {'repeat_func': repeat_func, 'repeat_func_eof': repeat_func_eof}
+
+
 def repeat_func(func: Callable[[], Union[T, Awaitable[T]]], times: int=None, *, interval: float=0) -> AsyncIterator[T]:
     """
     Repeats the result of a 0-ary function either indefinitely, or for a defined number of times.
@@ -20,11 +38,9 @@ def repeat_func(func: Callable[[], Union[T, Awaitable[T]]], times: int=None, *,
     A useful idiom is to combine an indefinite `repeat_func` stream with `aiostream.select.takewhile`
     to terminate the stream at some point.
     """
-    base = stream.repeat.raw((), times, interval=interval)
-    return cast(AsyncIterator[T], stream.starmap.raw(base, func, task_limit=1))
+    return cast(AsyncIterator[T], _operators()['repeat_func'](func, times, interval=interval))
 
 
-@operator
 def repeat_func_eof(func: Callable[[], Union[T, Awaitable[T]]], eof: Any, *, interval: float=0, use_is: bool=False) -> AsyncIterator[T]:
     """
     Repeats the result of a 0-ary function until an `eof` item is reached.
@@ -32,9 +48,7 @@ def repeat_func_eof(func: Callable[[], Union[T, Awaitable[T]]], eof: Any, *, int
     eof is checked by identity rather than equality.
     `times` and `interval` behave exactly like with `aiostream.create.repeat`.
     """
-    pred = (lambda item: item != eof) if not use_is else (lambda item: (item is not eof))
-    base = repeat_func.raw(func, interval=interval)
-    return cast(AsyncIterator[T], stream.takewhile.raw(base, pred))
+    return cast(AsyncIterator[T], _operators()['repeat_func_eof'](func, eof, interval=interval, use_is=use_is))
 
 
 def stream_from_queue(queue: asyncio.Queue, eof: Any=__DEFAULT, *, use_is: bool=False) -> AsyncIterator[Any]:
@@ -43,6 +57,6 @@ def stream_from_queue(queue: asyncio.Queue, eof: Any=__DEFAULT, *, use_is: bool=
     If no `eof` is given, the stream does not stop.
     """
     if eof is not __DEFAULT:
-        return cast(AsyncIterator[Any], repeat_func_eof(queue.get, eof, use_is=use_is))
+        return repeat_func_eof(queue.get, eof, use_is=use_is)
     else:
-        return cast(AsyncIterator[Any], repeat_func(queue.get))
+        return repeat_func(queue.get)
@@ -1,73 +1,310 @@
-from typing import cast, Callable, Dict, Iterable, Type, TypeVar
+from typing import cast, Callable, Dict, Hashable, Iterable, Optional, Tuple, Type, TypeVar, TYPE_CHECKING
 from abc import abstractmethod
 
-from dataclasses import dataclass
-
-from google.protobuf.message import Message as ProtoMessage
+import struct
+import time
+import zlib
+from dataclasses import dataclass, field
 
 from hedgehog.utils import SimpleDecorator, Registry
 
-__all__ = ['message', 'ContainerMessage', 'Message', 'SimpleMessageMixin']
+if TYPE_CHECKING:
+    # only used in annotations; the actual proto classes are provided by the user
+    from google.protobuf.descriptor import FieldDescriptor
+    from google.protobuf.message import Message as ProtoMessage
+
+__all__ = ['message', 'ContainerMessage', 'Message', 'SimpleMessageMixin', 'DeltaEncoder', 'DeltaDecoder',
+           'Codec', 'codecs', 'register_codec', 'ZLIB', 'LZMA', 'Compression', 'CompressionStats']
+
+ParseFn = Callable[['ProtoMessage'], 'Message']
+
+# A serialized container message never starts with a zero byte, as protobuf field numbers start at one.
+# A leading zero byte therefore marks an envelope, whose second byte identifies how the rest is encoded.
+ENVELOPE = b'\x00'
+DELTA = b'\x01'
+COMPRESSED = b'\x02'
+FIXED = b'\x03'
+
+# sequence number within the keyframe's chain, and number of unchanged fields
+_DELTA_HEADER = struct.Struct('<II')
+_DELTA_SEQUENCE_MASK = 0xFFFFFFFF
+_DELTA_FIELD = struct.Struct('<I')
+_FIXED_HEADER = struct.Struct('<H')
 
-ParseFn = Callable[[ProtoMessage], 'Message']
+
+def _is_repeated(field: 'FieldDescriptor') -> bool:
+    try:
+        return bool(field.is_repeated)
+    except AttributeError:  # pragma: nocover
+        # protobuf before 5.x
+        return bool(field.label == field.LABEL_REPEATED)
 
 
 @dataclass(frozen=True)
 class message:
-    proto_class: Type[ProtoMessage]
+    """
+    Declares the proto class, discriminator and fields of a message class.
+
+    A message may additionally declare a fixed binary `layout`: a `struct` format string with one item per field, in
+    the order of `fields`, which must then list all of the proto's fields. Containers that have `fixed_layouts` enabled
+    send such messages as the proto's field values packed in that layout instead of as protobuf. The layout may be
+    narrower than the proto field types; messages with values that don't fit are sent as protobuf. As the container
+    must know the message class to parse the layout, layouts can only be declared through `ContainerMessage.message`.
+    """
+    proto_class: Type['ProtoMessage']
     discriminator: str
     fields: Iterable[str] = None  # type: ignore
+    layout: str = None  # type: ignore
+    packer: struct.Struct = field(init=False, default=None, repr=False, compare=False)  # type: ignore
 
     def __post_init__(self):
         if self.fields is None:
             fields = tuple(field.name for field in self.proto_class.DESCRIPTOR.fields)
             object.__setattr__(self, 'fields', fields)
+        if self.layout is not None:
+            packer = struct.Struct(self.layout)
+            if len(packer.unpack(bytes(packer.size))) != len(tuple(self.fields)):
+                raise ValueError(f"layout {self.layout!r} doesn't match fields {self.fields!r}")
+            object.__setattr__(self, 'packer', packer)
 
     def __call__(self, message_class: Type['Message']) -> Type['Message']:
+        if self.layout is not None:
+            raise ValueError(f"the layout of {message_class.__name__} must be declared via ContainerMessage.message")
+        return self._apply(message_class)
+
+    def _apply(self, message_class: Type['Message']) -> Type['Message']:
         message_class.meta = self
         return message_class
 
 
+@dataclass(frozen=True)
+class Codec:
+    """
+    A compression algorithm usable by `Compression`. The id is sent with every compressed message and must be unique;
+    ids up to 127 are reserved for codecs defined here.
+    """
+    id: int
+    name: str
+    compress: Callable[[bytes], bytes]
+    decompress: Callable[[bytes], bytes]
+
+
+codecs = Registry[int, Codec]()
+
+
+def register_codec(codec: Codec) -> Codec:
+    """
+    Makes a codec known for decompression; compressing with a codec works without registering it.
+    """
+    if codec.id in codecs and codecs[codec.id] != codec:
+        raise ValueError(f"codec id {codec.id} is already used by {codecs[codec.id].name!r}")
+    codecs[codec.id] = codec
+    return codec
+
+
+def _lzma_compress(data: bytes) -> bytes:
+    import lzma
+    return lzma.compress(data)
+
+
+def _lzma_decompress(data: bytes) -> bytes:
+    import lzma
+    return lzma.decompress(data)
+
+
+ZLIB = register_codec(Codec(1, 'zlib', zlib.compress, zlib.decompress))
+LZMA = register_codec(Codec(2, 'lzma', _lzma_compress, _lzma_decompress))
+
+
+@dataclass
+class CompressionStats:
+    """
+    Counters to tune a `Compression`'s threshold: `ratio` is the size after compression relative to the size before,
+    over all payloads that reached the threshold; times are in seconds.
+    """
+    compressed: int = 0
+    # payloads that reached the threshold, but didn't get smaller and were sent uncompressed
+    skipped: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    compress_time: float = 0
+    decompressed: int = 0
+    decompress_time: float = 0
+
+    @property
+    def ratio(self) -> float:
+        return self.bytes_out / self.bytes_in if self.bytes_in else 1.0
+
+
+class Compression:
+    """
+    Compresses serialized container messages of at least `threshold` bytes using the given codec.
+    Compressed messages are marked by an envelope, so the receiving container detects them without configuration.
+    """
+
+    def __init__(self, codec: Codec=ZLIB, *, threshold: int=1024) -> None:
+        self.codec = codec
+        self.threshold = threshold
+        self.stats = CompressionStats()
+
+    def compress(self, data: bytes) -> bytes:
+        if len(data) < self.threshold:
+            return data
+
+        start = time.perf_counter()
+        compressed = b''.join([ENVELOPE, COMPRESSED, bytes((self.codec.id,)), self.codec.compress(data)])
+        self.stats.compress_time += time.perf_counter() - start
+        self.stats.bytes_in += len(data)
+
+        if len(compressed) >= len(data):
+            self.stats.skipped += 1
+            self.stats.bytes_out += len(data)
+            return data
+        self.stats.compressed += 1
+        self.stats.bytes_out += len(compressed)
+        return compressed
+
+
+def _decompress(data: bytes, stats: CompressionStats=None) -> bytes:
+    if data[:2] != ENVELOPE + COMPRESSED:
+        return data
+    if len(data) < 3:
+        raise ValueError("truncated compression envelope")
+    codec = codecs.get(data[2])
+    if codec is None:
+        raise ValueError(f"unknown compression codec {data[2]}")
+
+    start = time.perf_counter()
+    result = codec.decompress(data[3:])
+    if stats is not None:
+        stats.decompress_time += time.perf_counter() - start
+        stats.decompressed += 1
+    return result
+
+
 class ContainerMessage:
-    def __init__(self, proto_class: Type[ProtoMessage]) -> None:
+    """
+    Parses and serializes messages wrapped in a proto class with a `payload` oneof.
+
+    Messages registered via `message` with a fixed layout can always be parsed in that layout;
+    they are only serialized that way with `fixed_layouts` enabled, which must only be done if all receivers support it.
+    """
+
+    def __init__(self, proto_class: Type['ProtoMessage'], *, compression: Compression=None,
+                 fixed_layouts: bool=False) -> None:
         self.parse_fns = Registry[str, ParseFn]()
+        self.fixed_classes = Registry[int, Type['Message']]()
         self.proto_class = proto_class
+        self.compression = compression
+        self.fixed_layouts = fixed_layouts
+        self._fixed_ids = {}  # type: Dict[Type[Message], int]
 
-    def message(self, proto_class: Type[ProtoMessage], discriminator: str, fields: Iterable[str]=None)\
-            -> SimpleDecorator[Type['Message']]:
-        message_decorator = message(proto_class, discriminator, fields)  # type: ignore
+    def message(self, proto_class: Type['ProtoMessage'], discriminator: str, fields: Iterable[str]=None,
+                layout: str=None) -> SimpleDecorator[Type['Message']]:
+        message_decorator = message(proto_class, discriminator, fields, layout)  # type: ignore
         parser_decorator = self.parser(discriminator)
+        if layout is not None:
+            # the fixed layout is filled from and into the proto, so it must hold every (scalar) field
+            proto_fields = proto_class.DESCRIPTOR.fields_by_name
+            if set(message_decorator.fields) != set(proto_fields):
+                raise ValueError(f"the layout of {discriminator!r} must cover the fields {tuple(proto_fields)!r}")
+            for name in message_decorator.fields:
+                proto_field = proto_fields[name]
+                if proto_field.message_type is not None or _is_repeated(proto_field):
+                    raise ValueError(f"field {name!r} of {discriminator!r} can't be part of a layout")
 
         def decorator(message_class: Type[Message]) -> Type[Message]:
-            message_class = message_decorator(message_class)
+            message_class = message_decorator._apply(message_class)
             parser_decorator(cast(SimpleMessageMixin, message_class)._parse)
+            if layout is not None:
+                # messages in fixed layout are identified by the field number of their discriminator
+                fixed_id = self.proto_class.DESCRIPTOR.fields_by_name[discriminator].number
+                self.fixed_classes[fixed_id] = message_class
+                self._fixed_ids[message_class] = fixed_id
             return message_class
         return decorator
 
     def parser(self, discriminator: str) -> SimpleDecorator[ParseFn]:
         return self.parse_fns.register(discriminator)
 
-    def parse(self, data: bytes) -> 'Message':
+    def _compress(self, data: bytes) -> bytes:
+        return self.compression.compress(data) if self.compression is not None else data
+
+    def _decompress(self, data: bytes) -> bytes:
+        # compressed messages are accepted even if this container doesn't compress itself
+        return _decompress(data, self.compression.stats if self.compression is not None else None)
+
+    def _parse_proto(self, data: bytes) -> 'ProtoMessage':
+        data = self._decompress(data)
+        if data[:1] == ENVELOPE:
+            kind = data[1:2]
+            if kind == DELTA:
+                raise ValueError("delta encoded messages must be parsed by a DeltaDecoder")
+            raise ValueError(f"unknown envelope kind {kind!r}")
         msg = self.proto_class()
         msg.ParseFromString(data)
+        return msg
+
+    def _parse_payload(self, msg: 'ProtoMessage') -> 'Message':
         discriminator = cast(str, msg.WhichOneof('payload'))
         parse_fn = self.parse_fns[discriminator]
         return parse_fn(getattr(msg, discriminator))
 
-    def serialize(self, instance: 'Message') -> bytes:
+    def _parse_fixed(self, data: bytes) -> 'Message':
+        offset = 2 + _FIXED_HEADER.size
+        if len(data) < offset:
+            raise ValueError("truncated fixed layout header")
+        fixed_id, = _FIXED_HEADER.unpack_from(data, 2)
+        message_class = self.fixed_classes.get(fixed_id)
+        if message_class is None:
+            raise ValueError(f"no message with a fixed layout is registered for field number {fixed_id}")
+        meta = message_class.meta
+        if len(data) != offset + meta.packer.size:
+            raise ValueError(f"invalid length of fixed layout message {meta.discriminator!r}")
+        msg = meta.proto_class()
+        for name, value in zip(meta.fields, meta.packer.unpack_from(data, offset)):
+            setattr(msg, name, value)
+        return self.parse_fns[meta.discriminator](msg)
+
+    def parse(self, data: bytes) -> 'Message':
+        data = self._decompress(data)
+        if data[:2] == ENVELOPE + FIXED:
+            return self._parse_fixed(data)
+        return self._parse_payload(self._parse_proto(data))
+
+    def _serialize_proto(self, instance: 'Message') -> 'ProtoMessage':
         msg = self.proto_class()
-        instance.serialize(getattr(msg, instance.meta.discriminator))
-        return msg.SerializeToString()
+        instance._serialize(getattr(msg, instance.meta.discriminator))
+        return msg
+
+    def _serialize_fixed(self, instance: 'Message') -> Optional[bytes]:
+        fixed_id = self._fixed_ids.get(type(instance))
+        if fixed_id is None:
+            return None
+        meta = instance.meta
+        msg = meta.proto_class()
+        instance._serialize(msg)
+        try:
+            packed = meta.packer.pack(*(getattr(msg, name) for name in meta.fields))
+        except (struct.error, OverflowError):
+            return None
+        return b''.join([ENVELOPE, FIXED, _FIXED_HEADER.pack(fixed_id), packed])
+
+    def serialize(self, instance: 'Message') -> bytes:
+        data = self._serialize_fixed(instance) if self.fixed_layouts else None
+        if data is None:
+            data = self._serialize_proto(instance).SerializeToString()
+        return self._compress(data)
 
 
 class Message:
     meta = None  # type: message
 
     @abstractmethod
-    def _serialize(self, msg: ProtoMessage) -> None:
+    def _serialize(self, msg: 'ProtoMessage') -> None:
         raise NotImplemented
 
-    def serialize(self, msg: ProtoMessage=None) -> bytes:
+    def serialize(self, msg: 'ProtoMessage'=None) -> bytes:
         msg = msg or self.meta.proto_class()
         self._serialize(msg)
         return msg.SerializeToString()
@@ -76,7 +313,7 @@ class Message:
 class SimpleMessageMixin:
     @classmethod
     @abstractmethod
-    def _parse(cls, msg: ProtoMessage) -> Message:
+    def _parse(cls, msg: 'ProtoMessage') -> Message:
         raise NotImplemented
 
     @classmethod
@@ -84,3 +321,122 @@ class SimpleMessageMixin:
         msg = cast(Message, cls).meta.proto_class()
         msg.ParseFromString(data)
         return cls._parse(msg)
+
+
+def _copy_proto(msg: 'ProtoMessage') -> 'ProtoMessage':
+    result = type(msg)()
+    result.CopyFrom(msg)
+    return result
+
+
+class DeltaEncoder:
+    """
+    Serializes messages of a container so that fields that didn't change since the last message are left out.
+
+    For each key (e.g. a peer or topic) and message type, the last sent message is remembered. Of the next message of
+    that type, the fields listed in `meta.fields` that are equal to the last message's are cleared, and their field
+    numbers are sent in the delta's header instead. Every `keyframe_interval`th message, the full message is sent as
+    a regular serialized container, which `DeltaDecoder` uses to (re)initialize its state.
+
+    Every message after a keyframe carries its sequence number, so that the decoder detects lost messages instead of
+    restoring fields from stale state. The receiving side must use a `DeltaDecoder` with the same keys.
+    """
+
+    def __init__(self, container: ContainerMessage, *, keyframe_interval: int=100) -> None:
+        self.container = container
+        self.keyframe_interval = keyframe_interval
+        self._last = {}  # type: Dict[Tuple[Hashable, str], Tuple[ProtoMessage, int]]
+
+    def reset(self, key: Hashable=None) -> None:
+        """
+        Forgets the last messages sent for a key, so that the next message of every type is a keyframe.
+        Use this e.g. when a peer reconnects.
+        """
+        for state_key in [state_key for state_key in self._last if state_key[0] == key]:
+            del self._last[state_key]
+
+    def serialize(self, instance: 'Message', key: Hashable=None) -> bytes:
+        msg = self.container._serialize_proto(instance)
+        discriminator = instance.meta.discriminator
+        payload = getattr(msg, discriminator)
+
+        state_key = (key, discriminator)
+        last, count = self._last.get(state_key, (None, self.keyframe_interval))
+        if count >= self.keyframe_interval:
+            self._last[state_key] = _copy_proto(payload), 1
+            return self.container._compress(msg.SerializeToString())
+        self._last[state_key] = _copy_proto(payload), count + 1
+
+        fields_by_name = payload.DESCRIPTOR.fields_by_name
+        unchanged = [name for name in instance.meta.fields
+                     if name in fields_by_name and getattr(payload, name) == getattr(last, name)]
+        for name in unchanged:
+            payload.ClearField(name)
+        # even without unchanged fields, the delta envelope is needed for the sequence number
+        return self.container._compress(b''.join([
+            ENVELOPE, DELTA, _DELTA_HEADER.pack(count & _DELTA_SEQUENCE_MASK, len(unchanged)),
+            *(_DELTA_FIELD.pack(fields_by_name[name].number) for name in unchanged),
+            msg.SerializeToString(),
+        ]))
+
+
+class DeltaDecoder:
+    """
+    Parses messages serialized by a `DeltaEncoder`, restoring the fields that were left out from the last message
+    received for the same key and message type.
+
+    If a message was lost, the following deltas raise a `ValueError` until the next keyframe is received.
+    """
+
+    def __init__(self, container: ContainerMessage) -> None:
+        self.container = container
+        self._last = {}  # type: Dict[Tuple[Hashable, str], Tuple[ProtoMessage, int]]
+
+    def reset(self, key: Hashable=None) -> None:
+        for state_key in [state_key for state_key in self._last if state_key[0] == key]:
+            del self._last[state_key]
+
+    def _parse_delta(self, data: bytes, key: Hashable) -> Tuple['ProtoMessage', int]:
+        offset = 2 + _DELTA_HEADER.size
+        if len(data) < offset:
+            raise ValueError("truncated delta header")
+        sequence, count = _DELTA_HEADER.unpack_from(data, 2)
+        end = offset + count * _DELTA_FIELD.size
+        if len(data) < end:
+            raise ValueError("truncated delta header")
+        unchanged = {number for number, in _DELTA_FIELD.iter_unpack(data[offset:end])}
+        msg = self.container._parse_proto(data[end:])
+
+        discriminator = cast(str, msg.WhichOneof('payload'))
+        state_key = (key, discriminator)
+        if state_key not in self._last:
+            raise ValueError(f"received delta for {discriminator!r} without a keyframe")
+        last, last_sequence = self._last[state_key]
+        if sequence != (last_sequence + 1) & _DELTA_SEQUENCE_MASK:
+            # a message was lost; the state is stale until the next keyframe
+            del self._last[state_key]
+            raise ValueError(f"received delta {sequence} for {discriminator!r} after {last_sequence}")
+
+        payload = getattr(msg, discriminator)
+        full = _copy_proto(last)
+        for field in payload.DESCRIPTOR.fields:
+            if field.number not in unchanged:
+                full.ClearField(field.name)
+        full.MergeFrom(payload)
+        payload.CopyFrom(full)
+        return msg, sequence
+
+    def parse(self, data: bytes, key: Hashable=None) -> 'Message':
+        data = self.container._decompress(data)
+        if data[:2] == ENVELOPE + FIXED:
+            # fixed layout messages are always complete and don't take part in delta encoding
+            return self.container._parse_fixed(data)
+        if data[:2] == ENVELOPE + DELTA:
+            msg, sequence = self._parse_delta(data, key)
+        else:
+            # keyframes start a new sequence
+            msg, sequence = self.container._parse_proto(data), 0
+
+        discriminator = cast(str, msg.WhichOneof('payload'))
+        self._last[key, discriminator] = _copy_proto(getattr(msg, discriminator)), sequence
+        return self.container._parse_payload(msg)
@@ -0,0 +1,132 @@
+"""
+Conversion between batches of same-type messages and NumPy arrays, for vectorized analysis of recorded messages.
+
+The columns of a message type are its `meta.fields`; their dtypes are derived from the proto descriptor.
+Scalar numeric, bool and enum fields map to the corresponding NumPy types,
+all other fields (strings, bytes, sub-messages, repeated fields) to object columns.
+"""
+
+from typing import cast, Any, Dict, Iterable, List, Mapping, Sequence, Type
+
+import numpy as np
+from google.protobuf.descriptor import FieldDescriptor
+
+from . import Message, ParseFn, SimpleMessageMixin, _is_repeated
+
+__all__ = ['dtype', 'to_columns', 'to_array', 'parse_columns', 'parse_array', 'from_columns', 'from_array']
+
+Columns = Dict[str, np.ndarray]
+
+_CPP_DTYPES = {
+    FieldDescriptor.CPPTYPE_INT32: np.dtype('<i4'),
+    FieldDescriptor.CPPTYPE_INT64: np.dtype('<i8'),
+    FieldDescriptor.CPPTYPE_UINT32: np.dtype('<u4'),
+    FieldDescriptor.CPPTYPE_UINT64: np.dtype('<u8'),
+    FieldDescriptor.CPPTYPE_DOUBLE: np.dtype('<f8'),
+    FieldDescriptor.CPPTYPE_FLOAT: np.dtype('<f4'),
+    FieldDescriptor.CPPTYPE_BOOL: np.dtype('?'),
+    FieldDescriptor.CPPTYPE_ENUM: np.dtype('<i4'),
+}  # type: Dict[int, np.dtype]
+
+
+def _field_dtype(message_class: Type[Message], name: str) -> np.dtype:
+    field = message_class.meta.proto_class.DESCRIPTOR.fields_by_name.get(name)
+    if field is None or _is_repeated(field):
+        return np.dtype(object)
+    return _CPP_DTYPES.get(field.cpp_type, np.dtype(object))
+
+
+def dtype(message_class: Type[Message]) -> np.dtype:
+    """
+    Returns the structured dtype holding one message of the given type per element.
+    """
+    return np.dtype([(name, _field_dtype(message_class, name)) for name in message_class.meta.fields])
+
+
+def _columns(message_class: Type[Message], items: Sequence[Any]) -> Columns:
+    result = {}
+    for name in message_class.meta.fields:
+        field_dtype = _field_dtype(message_class, name)
+        values = (getattr(item, name) for item in items)
+        if field_dtype == np.dtype(object):
+            column = np.empty(len(items), dtype=object)
+            column[:] = list(values)
+        else:
+            column = np.fromiter(values, dtype=field_dtype, count=len(items))
+        result[name] = column
+    return result
+
+
+def _array(message_class: Type[Message], columns: Columns) -> np.ndarray:
+    length = len(next(iter(columns.values()))) if columns else 0
+    result = np.empty(length, dtype=dtype(message_class))
+    for name, column in columns.items():
+        result[name] = column
+    return result
+
+
+def to_columns(message_class: Type[Message], messages: Sequence[Message]) -> Columns:
+    """
+    Converts messages of the given type into a dict of one array per field.
+    """
+    return _columns(message_class, messages)
+
+
+def to_array(message_class: Type[Message], messages: Sequence[Message]) -> np.ndarray:
+    """
+    Converts messages of the given type into a structured array.
+    """
+    return _array(message_class, to_columns(message_class, messages))
+
+
+def _parse_all(message_class: Type[Message], payloads: Iterable[bytes], parse_fn: ParseFn=None) -> List[Message]:
+    if parse_fn is None:
+        if not issubclass(message_class, SimpleMessageMixin):
+            raise TypeError(f"{message_class.__name__} has no _parse method, a parse_fn must be given")
+        parse_fn = cast(SimpleMessageMixin, message_class)._parse
+
+    proto_class = message_class.meta.proto_class
+    result = []
+    for payload in payloads:
+        proto = proto_class()
+        proto.ParseFromString(payload)
+        msg = parse_fn(proto)
+        if not isinstance(msg, message_class):
+            raise ValueError(f"payload was parsed as {type(msg).__name__}, not {message_class.__name__}")
+        result.append(msg)
+    return result
+
+
+def parse_columns(message_class: Type[Message], payloads: Iterable[bytes], parse_fn: ParseFn=None) -> Columns:
+    """
+    Converts serialized messages of the given type (i.e. the results of `Message.serialize`) into a dict of one array
+    per field. Every payload is parsed by `parse_fn`, which defaults to the `_parse` method of `SimpleMessageMixin`
+    classes; for other message classes, pass the registered parse function, e.g. `container.parse_fns[discriminator]`.
+    A `ValueError` is raised for payloads that don't parse as `message_class`.
+    """
+    return _columns(message_class, _parse_all(message_class, payloads, parse_fn))
+
+
+def parse_array(message_class: Type[Message], payloads: Iterable[bytes], parse_fn: ParseFn=None) -> np.ndarray:
+    """
+    Converts serialized messages of the given type into a structured array, see `parse_columns`.
+    """
+    return _array(message_class, parse_columns(message_class, payloads, parse_fn))
+
+
+def from_columns(message_class: Type[Message], columns: Mapping[str, np.ndarray]) -> List[Message]:
+    """
+    Creates messages of the given type from a dict of one array per field.
+    Each message is created by passing its field values as keyword arguments to the message class.
+    """
+    names = list(message_class.meta.fields)
+    values = [columns[name].tolist() for name in names]
+    return [cast(Message, message_class(**dict(zip(names, row))))  # type: ignore
+            for row in zip(*values)]
+
+
+def from_array(message_class: Type[Message], array: np.ndarray) -> List[Message]:
+    """
+    Creates messages of the given type from a structured array.
+    """
+    return from_columns(message_class, {name: array[name] for name in message_class.meta.fields})
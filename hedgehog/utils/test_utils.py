@@ -1,13 +1,24 @@
-from typing import Any, Generator, List
+from typing import Any, Callable, Generator, List, Optional, Sequence
 
 import pytest
 import asyncio
+import itertools
 import logging
 import selectors
+import struct
+import time
 from contextlib import contextmanager
+from dataclasses import dataclass, field
 
 
 class SelectorTimeTrackingTestLoop(asyncio.SelectorEventLoop):  # type: ignore
+    """
+    An event loop that runs on virtual time: instead of waiting for a timeout, the loop's time is advanced by it.
+    Every select with a timeout first checks for I/O events that are already pending; these are delivered without
+    advancing time, and no step is recorded. Otherwise, the timeout is recorded in `steps` (including zero timeouts)
+    and the loop's time is advanced by it.
+    """
+
     class TestSelector(selectors.BaseSelector):
         def __init__(self, loop: 'SelectorTimeTrackingTestLoop', selector: selectors.BaseSelector) -> None:
             self._loop = loop
@@ -26,8 +37,12 @@ class SelectorTimeTrackingTestLoop(asyncio.SelectorEventLoop):  # type: ignore
 
         def select(self, timeout=None, *args, **kwargs):
             if timeout is not None:
-                # instead of waiting for real seconds,
+                # events that are already pending are delivered without advancing time.
+                # otherwise, instead of waiting for real seconds,
                 # just deliver no events and let the event loop continue immediately.
+                events = self._selector.select(0, *args, **kwargs)
+                if events:
+                    return events
                 self._loop.advance_time(timeout)
                 timeout = 0
             return self._selector.select(timeout, *args, **kwargs)
@@ -167,6 +182,146 @@ def assertImmediate() -> Generator[None, None, None]:
         yield
 
 
+@contextmanager
+def assertCpuTime(budget: float) -> Generator[None, None, None]:
+    """
+    A context manager that checks the code executed in its context used at most the given amount of CPU time,
+    in seconds. Unlike event loop time, CPU time is real; budgets should be generous to avoid spurious failures.
+    """
+    begin = time.process_time()
+    yield
+    end = time.process_time()
+    assert end - begin <= budget
+
+
+_TIMESTAMP = struct.Struct('<d')
+
+
+@dataclass
+class LoadReport:
+    """
+    The result of a `LoadGenerator` run. `duration` and `latencies` are measured in event loop time,
+    `cpu_time` in real CPU time.
+    """
+    sent: int = 0
+    received: int = 0
+    duration: float = 0
+    cpu_time: float = 0
+    latencies: List[float] = field(default_factory=list)
+
+    @property
+    def throughput(self) -> float:
+        return self.received / self.duration if self.duration else float('inf')
+
+    @property
+    def max_latency(self) -> float:
+        return max(self.latencies, default=0)
+
+    def assert_budget(self, *, min_throughput: float=None, max_latency: float=None, max_cpu_time: float=None) -> None:
+        assert self.received == self.sent
+        if min_throughput is not None:
+            assert self.throughput >= min_throughput
+        if max_latency is not None:
+            assert self.max_latency <= max_latency
+        if max_cpu_time is not None:
+            assert self.cpu_time <= max_cpu_time
+
+
+_load_ids = itertools.count()
+
+
+class LoadGenerator:
+    """
+    Simulates `producers` sending to `consumers` over inproc PUSH/PULL sockets.
+
+    Each producer sends `rate` messages per second of event loop time for `duration` seconds, each message consisting
+    of a timestamp frame and `payload`. Consumers pass the payload frames to `handler`, if given, and record the
+    latency of every message. On a `SelectorTimeTrackingTestLoop`, the run takes almost no real time and its timing is
+    deterministic; only the CPU time measurement depends on the machine.
+    """
+
+    def __init__(self, ctx, *, producers: int=1, consumers: int=1, rate: float=100, duration: float=1,
+                 payload: Sequence[bytes]=(b'',), handler: Callable[[List[bytes]], None]=None,
+                 name: str='load') -> None:
+        self.ctx = ctx
+        self.producers = producers
+        self.consumers = consumers
+        self.rate = rate
+        self.duration = duration
+        self.payload = list(payload)
+        self.handler = handler
+        self.name = name
+
+    @property
+    def messages_per_producer(self) -> int:
+        return int(self.duration * self.rate)
+
+    async def run(self) -> LoadReport:
+        import zmq
+
+        loop = asyncio.get_event_loop()
+        report = LoadReport()
+        total = self.producers * self.messages_per_producer
+        done = asyncio.Event()
+        # inproc names are released asynchronously when closing, so every run uses new endpoints
+        endpoint = f'inproc://{self.name}-{next(_load_ids)}'
+
+        pulls = [self.ctx.socket(zmq.PULL).configure(hwm=total + 1, linger=0) for _ in range(self.consumers)]
+        pushes = [self.ctx.socket(zmq.PUSH).configure(hwm=total + 1, linger=0) for _ in range(self.producers)]
+        try:
+            for i, pull in enumerate(pulls):
+                pull.bind(f'{endpoint}-{i}')
+            for push in pushes:
+                for i in range(self.consumers):
+                    push.connect(f'{endpoint}-{i}')
+
+            async def produce(push) -> None:
+                start = loop.time()
+                for k in range(self.messages_per_producer):
+                    delay = start + k / self.rate - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    await push.send_multipart([_TIMESTAMP.pack(loop.time()), *self.payload])
+                    report.sent += 1
+
+            async def consume(pull) -> None:
+                while True:
+                    timestamp, *frames = await pull.recv_multipart()
+                    report.latencies.append(loop.time() - _TIMESTAMP.unpack(timestamp)[0])
+                    if self.handler is not None:
+                        self.handler(frames)
+                    report.received += 1
+                    if report.received == total:
+                        done.set()
+
+            begin, cpu_begin = loop.time(), time.process_time()
+            consumer_tasks = [asyncio.ensure_future(consume(pull)) for pull in pulls]
+            try:
+                await asyncio.gather(*(produce(push) for push in pushes))
+                if total:
+                    await done.wait()
+            finally:
+                for task in consumer_tasks:
+                    task.cancel()
+                await asyncio.gather(*consumer_tasks, return_exceptions=True)
+            report.duration, report.cpu_time = loop.time() - begin, time.process_time() - cpu_begin
+        finally:
+            for socket in pushes + pulls:
+                socket.close()
+        return report
+
+
+@pytest.fixture
+def load_generator(zmq_aio_ctx):
+    """
+    A factory for `LoadGenerator`s using the `zmq_aio_ctx` fixture; use together with the `event_loop` fixture
+    so that load is generated in virtual time.
+    """
+    def factory(**kwargs) -> LoadGenerator:
+        return LoadGenerator(zmq_aio_ctx, **kwargs)
+    return factory
+
+
 try:
     import trio
     import pytest_trio
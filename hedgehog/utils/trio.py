@@ -0,0 +1,124 @@
+from typing import Any, AsyncIterable, AsyncIterator, List, Sequence
+
+import trio
+from contextlib import asynccontextmanager
+
+__all__ = ['stream_from_channel', 'batches_from_channel', 'stream_from_socket', 'batches_from_socket', 'buffered']
+
+__DEFAULT = object()
+
+
+def _is_eof(item: Any, eof: Any, use_is: bool) -> bool:
+    if eof is __DEFAULT:
+        return False
+    return item is eof if use_is else item == eof
+
+
+async def stream_from_channel(channel: trio.abc.ReceiveChannel, eof: Any=__DEFAULT, *,
+                              use_is: bool=False) -> AsyncIterator[Any]:
+    """
+    Repeatedly receives an item from the given channel, until an item equal to `eof` (using `==` or `is`) is
+    encountered or the channel is closed by its sender.
+    If no `eof` is given, the stream only stops when the channel is closed.
+    """
+    async for item in channel:
+        if _is_eof(item, eof, use_is):
+            return
+        yield item
+
+
+async def batches_from_channel(channel: trio.abc.ReceiveChannel, eof: Any=__DEFAULT, *, use_is: bool=False,
+                               max_batch: int=None) -> AsyncIterator[List[Any]]:
+    """
+    Like `stream_from_channel`, but yields lists of items: after waiting for an item, all items that are already
+    available (up to `max_batch` in total) are added to the batch without waiting again.
+    The items before an `eof` item are yielded as a last batch; items after it are left in the channel.
+    """
+    while True:
+        try:
+            item = await channel.receive()
+        except trio.EndOfChannel:
+            return
+        batch = []  # type: List[Any]
+        while not _is_eof(item, eof, use_is):
+            batch.append(item)
+            if max_batch is not None and len(batch) >= max_batch:
+                break
+            try:
+                item = channel.receive_nowait()
+            except (trio.WouldBlock, trio.EndOfChannel):
+                break
+        else:
+            if batch:
+                yield batch
+            return
+        yield batch
+
+
+async def stream_from_socket(socket: Any, eof: Sequence[bytes]=__DEFAULT) -> AsyncIterator[List[bytes]]:
+    """
+    Repeatedly receives multipart messages from the given `hedgehog.utils.zmq.trio.Socket`,
+    until a message equal to `eof` is encountered. If no `eof` is given, the stream does not stop.
+    """
+    eof = list(eof) if eof is not __DEFAULT else eof
+    while True:
+        msg = await socket.recv_multipart()
+        if _is_eof(msg, eof, False):
+            return
+        yield msg
+
+
+async def batches_from_socket(socket: Any, eof: Sequence[bytes]=__DEFAULT, *,
+                              max_batch: int=None) -> AsyncIterator[List[List[bytes]]]:
+    """
+    Like `stream_from_socket`, but yields lists of messages: after waiting for a message, all messages that are already
+    queued (up to `max_batch` in total) are received without waiting again.
+    The messages before an `eof` message are yielded as a last batch; messages after it are left in the socket.
+    """
+    import zmq
+
+    eof = list(eof) if eof is not __DEFAULT else eof
+    while True:
+        msg = await socket.recv_multipart()
+        batch = []  # type: List[List[bytes]]
+        while not _is_eof(msg, eof, False):
+            batch.append(msg)
+            if max_batch is not None and len(batch) >= max_batch:
+                break
+            try:
+                msg = await socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+        else:
+            if batch:
+                yield batch
+            return
+        yield batch
+
+
+@asynccontextmanager
+async def buffered(iterable: AsyncIterable[Any], max_buffer: int=0) -> AsyncIterator[trio.abc.ReceiveChannel]:
+    """
+    Consumes the given async iterable in a background task, buffering up to `max_buffer` items that were not yet
+    received by the consumer; when the buffer is full, the background task waits.
+    Yields a receive channel that is closed by the background task when the iterable is exhausted,
+    and cancels the background task when the context is left.
+    """
+    send_channel, receive_channel = trio.open_memory_channel(max_buffer)
+
+    async def produce() -> None:
+        async with send_channel:
+            try:
+                async for item in iterable:
+                    await send_channel.send(item)
+            except trio.BrokenResourceError:
+                # the consumer closed the channel
+                pass
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(produce)
+        try:
+            yield receive_channel
+        finally:
+            nursery.cancel_scope.cancel()
+            await receive_channel.aclose()
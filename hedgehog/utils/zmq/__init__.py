@@ -1,16 +1,35 @@
-from typing import Tuple, Union
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, List, Optional, Sequence, Tuple, TypeVar, Union
+from typing import TYPE_CHECKING
 
+import importlib
 import zmq
 
 from .. import expect, expect_all
 
+if TYPE_CHECKING:
+    from .reactor import Reactor
+    from .tracing import Trace, Tracer
+
 __all__ = ['Context', 'Socket', 'Fileno', 'SocketLike']
 
+# the asyncio and trio flavors and the extensions are only imported when accessed
+_LAZY_SUBMODULES = {'asyncio', 'reactor', 'recorder', 'shm', 'tracing', 'trio'}
+
+
+def __getattr__(name: str) -> Any:
+    if name in _LAZY_SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 class _ConfigureSocketMixin:
-    def configure(self, *, hwm: int=None, rcvtimeo: int=None, sndtimeo: int=None, linger: int=None) -> 'Socket':
+    def configure(self, *, hwm: int=None, rcvtimeo: int=None, sndtimeo: int=None, linger: int=None,
+                  heartbeat_ivl: int=None, heartbeat_timeout: int=None, heartbeat_ttl: int=None) -> 'Socket':
         """
         Allows to configure some common socket options and configurations, while allowing method chaining
+
+        The heartbeat options (in milliseconds) enable ZMTP heartbeats, so that connections to dead peers are closed
+        by zmq without waiting for a request to time out. They must be set before connecting or binding.
         """
         if hwm is not None:
             self.set_hwm(hwm)
@@ -20,6 +39,12 @@ class _ConfigureSocketMixin:
             self.setsockopt(zmq.SNDTIMEO, sndtimeo)
         if linger is not None:
             self.setsockopt(zmq.LINGER, linger)
+        if heartbeat_ivl is not None:
+            self.setsockopt(zmq.HEARTBEAT_IVL, heartbeat_ivl)
+        if heartbeat_timeout is not None:
+            self.setsockopt(zmq.HEARTBEAT_TIMEOUT, heartbeat_timeout)
+        if heartbeat_ttl is not None:
+            self.setsockopt(zmq.HEARTBEAT_TTL, heartbeat_ttl)
         return self
 
 
@@ -48,6 +73,21 @@ class _SyncSocketExtensionsMixin:
         """
         expect_all(self.recv_multipart(), data)
 
+    def send_multipart_traced(self, msg: Sequence[bytes], tracer: 'Tracer', *args, envelope: int=0, **kwargs) -> None:
+        """
+        Sends a multipart message with a trace frame added by the given tracer, if it is enabled.
+        The trace frame is placed after `envelope` routing frames, see `Tracer`.
+        """
+        self.send_multipart(tracer.start(msg, envelope=envelope), *args, **kwargs)
+
+    def recv_multipart_traced(self, tracer: 'Tracer', *args, envelope: int=0, **kwargs)\
+            -> Tuple[List[bytes], Optional['Trace']]:
+        """
+        Receives a multipart message and strips its trace frame, recording its latencies in the given tracer.
+        The trace frame is expected after `envelope` routing frames, see `Tracer`.
+        """
+        return tracer.strip(self.recv_multipart(*args, **kwargs), envelope=envelope)
+
 
 class _AsyncSocketExtensionsMixin:
     async def signal(self) -> None:
@@ -74,6 +114,49 @@ class _AsyncSocketExtensionsMixin:
         """
         expect_all(await self.recv_multipart(), data)
 
+    async def send_multipart_traced(self, msg: Sequence[bytes], tracer: 'Tracer', *args, envelope: int=0,
+                                    **kwargs) -> None:
+        """
+        Sends a multipart message with a trace frame added by the given tracer, if it is enabled.
+        The trace frame is placed after `envelope` routing frames, see `Tracer`.
+        """
+        await self.send_multipart(tracer.start(msg, envelope=envelope), *args, **kwargs)
+
+    async def recv_multipart_traced(self, tracer: 'Tracer', *args, envelope: int=0, **kwargs)\
+            -> Tuple[List[bytes], Optional['Trace']]:
+        """
+        Receives a multipart message and strips its trace frame, recording its latencies in the given tracer.
+        The trace frame is expected after `envelope` routing frames, see `Tracer`.
+        """
+        return tracer.strip(await self.recv_multipart(*args, **kwargs), envelope=envelope)
+
+
+S = TypeVar('S')
+
+
+async def _merge_multipart(poll: Callable[[], Awaitable[Iterable[Tuple[S, int]]]], sockets: Iterable[S],
+                           batch: int) -> AsyncIterator[Tuple[S, List[bytes]]]:
+    """
+    Receives multipart messages from all sockets, using a single `poll` over all of them.
+    After each poll, every ready socket is drained of at most `batch` messages;
+    sockets that were served move to the back of the queue so that the others are served first next time.
+    """
+    order = list(sockets)
+    while True:
+        ready = {socket for socket, event in await poll() if event & zmq.POLLIN}
+        served = []
+        for socket in order:
+            if socket not in ready:
+                continue
+            for _ in range(batch):
+                try:
+                    frames = await socket.recv_multipart(zmq.NOBLOCK)  # type: ignore
+                except zmq.Again:
+                    break
+                yield socket, frames
+            served.append(socket)
+        order = [socket for socket in order if socket not in served] + served
+
 
 class Socket(_ConfigureSocketMixin, _SyncSocketExtensionsMixin, zmq.Socket):
     """
@@ -84,6 +167,13 @@ class Socket(_ConfigureSocketMixin, _SyncSocketExtensionsMixin, zmq.Socket):
 class Context(zmq.Context):
     _socket_class = Socket
 
+    def reactor(self, **kwargs) -> 'Reactor':
+        """
+        Creates a `hedgehog.utils.zmq.reactor.Reactor` for servicing sockets of this context from a single thread.
+        """
+        from .reactor import Reactor
+        return Reactor(self, **kwargs)
+
 
 Fileno = int
 SocketLike = Union[Socket, Fileno]
@@ -1,10 +1,13 @@
-from typing import Union
+from typing import cast, Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple, Union
 
+import asyncio
+import struct
 import zmq.asyncio
+from functools import lru_cache
 
-from . import _ConfigureSocketMixin, _AsyncSocketExtensionsMixin
+from . import _ConfigureSocketMixin, _AsyncSocketExtensionsMixin, _merge_multipart
 
-__all__ = ['Context', 'Socket', 'Fileno', 'SocketLike']
+__all__ = ['Context', 'Socket', 'Fileno', 'SocketLike', 'merge', 'SendPipeline', 'DualLaneSocket', 'Watchdog']
 
 
 class Socket(_ConfigureSocketMixin, _AsyncSocketExtensionsMixin, zmq.asyncio.Socket):
@@ -19,3 +22,327 @@ class Context(zmq.Context):
 
 Fileno = int
 SocketLike = Union[Socket, Fileno]
+
+
+async def _merge(*sockets: Socket, batch: int=1) -> AsyncIterator[Tuple[Socket, List[bytes]]]:
+    poller = zmq.asyncio.Poller()
+    for socket in sockets:
+        poller.register(socket, zmq.POLLIN)
+
+    async for item in _merge_multipart(poller.poll, sockets, batch):
+        yield item
+
+
+@lru_cache(maxsize=None)
+def _merge_operator() -> Any:
+    # aiostream is only imported once the operator is actually used
+    from aiostream import operator
+    return operator(_merge)
+
+
+def merge(*sockets: Socket, batch: int=1) -> AsyncIterator[Tuple[Socket, List[bytes]]]:
+    """
+    Yields `(socket, frames)` for multipart messages received on any of the given sockets, waiting on all of them
+    through a single poller. Sockets are served round-robin, at most `batch` messages at a time.
+    The result is an aiostream stream.
+    """
+    return cast(AsyncIterator[Tuple[Socket, List[bytes]]], _merge_operator()(*sockets, batch=batch))
+
+
+class SendPipeline:
+    """
+    Coalesces `send_multipart` calls from any number of tasks, sending them from a single flusher task.
+
+    Messages are queued in order and the flusher sends them in batches of up to `max_batch` messages without returning
+    to the event loop in between. With a positive `max_delay`, the flusher waits that long after the first message of a
+    batch for more to arrive, unless the batch fills up or `flush()` is called. When the socket's HWM is reached, the
+    flusher waits until the socket is writable again; once `max_queued` messages are waiting, `send_multipart` blocks
+    as well. As there is a single queue, messages sent by one task are always sent in order.
+
+    The pipeline must be used as an async context manager, which starts the flusher and flushes on exit.
+    """
+
+    def __init__(self, socket: Socket, *, max_batch: int=64, max_delay: float=0, max_queued: int=1000) -> None:
+        self.socket = socket
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_queued = max_queued
+        # messages put into the queue, taken from the queue by the flusher, and covered by the last flush
+        self._queued = self._taken = self._flushed = 0
+        self._task = None  # type: Optional[asyncio.Task]
+
+    async def __aenter__(self) -> 'SendPipeline':
+        # created here, so that they belong to the running loop
+        self._queue = asyncio.Queue(self.max_queued)  # type: asyncio.Queue
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        task = self._started()
+        try:
+            if exc_type is None:
+                await self._flush()
+        finally:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def _started(self) -> asyncio.Task:
+        if self._task is None:
+            raise RuntimeError("SendPipeline was not started")
+        return self._task
+
+    def _check(self) -> asyncio.Task:
+        task = self._started()
+        if task.done():
+            if not task.cancelled():
+                # reraises the flusher's exception
+                task.result()
+            raise RuntimeError("SendPipeline's flusher has stopped")
+        return task
+
+    async def send_multipart(self, frames: Sequence[bytes]) -> None:
+        """
+        Queues a multipart message for sending. This only blocks when `max_queued` messages are already waiting.
+        """
+        task = self._check()
+        if self._queue.full():
+            # don't wait for space in the queue forever if the flusher dies
+            put = asyncio.ensure_future(self._queue.put(frames))
+            await asyncio.wait([put, task], return_when=asyncio.FIRST_COMPLETED)
+            if not put.done():
+                put.cancel()
+                self._check()
+        else:
+            self._queue.put_nowait(frames)
+        self._queued += 1
+        if self._queue.qsize() >= self.max_batch:
+            self._wakeup.set()
+
+    async def flush(self) -> None:
+        """
+        Sends the current batch immediately and waits until all queued messages have been sent.
+        """
+        await self._flush()
+
+    async def _flush(self) -> None:
+        # not overridden by the trio version, so it can be used by __aexit__
+        task = self._check()
+        self._flushed = self._queued
+        self._wakeup.set()
+        join = asyncio.ensure_future(self._queue.join())
+        await asyncio.wait([join, task], return_when=asyncio.FIRST_COMPLETED)
+        if not join.done():
+            join.cancel()
+        self._check()
+
+    async def _send(self, frames: Sequence[bytes]) -> None:
+        # use the asyncio implementations directly, so that this also works for trio sockets
+        while True:
+            try:
+                await zmq.asyncio.Socket.send_multipart(self.socket, frames, zmq.NOBLOCK)
+            except zmq.Again:
+                await zmq.asyncio.Socket.poll(self.socket, None, zmq.POLLOUT)  # type: ignore
+            else:
+                return
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            self._taken += 1
+            # a wakeup set before this message was queued, e.g. by flushing an empty pipeline, doesn't count
+            if self.max_delay > 0 and self._queue.qsize() + 1 < self.max_batch and self._flushed < self._taken:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                self._taken += 1
+            for frames in batch:
+                await self._send(frames)
+                self._queue.task_done()
+
+
+# message id, number of frames, frame index, last chunk of the message
+_CHUNK_HEADER = struct.Struct('<QIIB')
+
+
+class DualLaneSocket:
+    """
+    Combines a control and a bulk socket, so that control messages don't wait behind large bulk messages.
+
+    The frames of bulk messages are split into chunks of at most `chunk_size` bytes that are sent as separate messages,
+    yielding to the event loop after each chunk. Chunks are sent as views of the original frames, so a bulk message is
+    only copied when it is reassembled by the receiver. When receiving, pending control messages are always returned
+    first; between two control checks, at most one bulk chunk is processed. Therefore a control message waits for at
+    most one chunk at the receiver, plus what is queued in front of it on the control socket itself.
+    `chunks_sent` and `chunks_received` count the bulk chunks, e.g. to measure control latency in chunks.
+
+    Chunks carry a message id that is unique per sender, so the sockets should connect exactly two peers.
+    """
+
+    CONTROL = 'control'
+    BULK = 'bulk'
+
+    def __init__(self, control: Socket, bulk: Socket, *, chunk_size: int=1 << 16) -> None:
+        self.control = control
+        self.bulk = bulk
+        self.chunk_size = chunk_size
+        self.chunks_sent = 0
+        self.chunks_received = 0
+        self._next_id = 0
+        self._partial = {}  # type: Dict[int, List[List[bytes]]]
+        self._poller = zmq.asyncio.Poller()
+        self._poller.register(control, zmq.POLLIN)
+        self._poller.register(bulk, zmq.POLLIN)
+
+    # the asyncio implementations are used directly, so that this also works for trio sockets
+
+    async def send_control(self, frames: Sequence[bytes]) -> None:
+        await zmq.asyncio.Socket.send_multipart(self.control, frames)
+
+    async def send_bulk(self, frames: Sequence[bytes]) -> None:
+        views = [memoryview(frame) for frame in frames]
+        msg_id = self._next_id
+        self._next_id += 1
+
+        # (frame index, offset) of every chunk; empty frames and messages are sent as a single empty chunk
+        chunks = [(i, offset) for i, view in enumerate(views) for offset in range(0, len(view) or 1, self.chunk_size)]
+        if not chunks:
+            chunks = [(0, 0)]
+        for n, (i, offset) in enumerate(chunks):
+            last = n == len(chunks) - 1
+            chunk = views[i][offset:offset + self.chunk_size] if views else b''
+            header = _CHUNK_HEADER.pack(msg_id, len(views), i, last)
+            await zmq.asyncio.Socket.send_multipart(self.bulk, (header, chunk), copy=False)
+            self.chunks_sent += 1
+            if not last:
+                # let control messages from other tasks through
+                await asyncio.sleep(0)
+
+    async def _recv_nowait(self, socket: Socket) -> Optional[List[bytes]]:
+        try:
+            return await zmq.asyncio.Socket.recv_multipart(socket, zmq.NOBLOCK)
+        except zmq.Again:
+            return None
+
+    async def recv_multipart(self) -> Tuple[str, List[bytes]]:
+        """
+        Receives the next message, returning the lane it was received on and its frames.
+        """
+        while True:
+            frames = await self._recv_nowait(self.control)
+            if frames is not None:
+                return self.CONTROL, frames
+
+            frames = await self._recv_nowait(self.bulk)
+            if frames is None:
+                await self._poller.poll()
+                continue
+
+            self.chunks_received += 1
+            header, chunk = frames
+            msg_id, count, index, last = _CHUNK_HEADER.unpack(header)
+            parts = self._partial.get(msg_id)
+            if parts is None:
+                parts = self._partial[msg_id] = [[] for _ in range(count)]
+            if count:
+                parts[index].append(chunk)
+            if last:
+                del self._partial[msg_id]
+                return self.BULK, [part[0] if len(part) == 1 else b''.join(part) for part in parts]
+
+
+class Watchdog:
+    """
+    Tracks whether a peer is alive, based on the time since its last message.
+
+    Call `touch()` for every message received from the peer, or receive through the watchdog's `recv_multipart`.
+    A background task, running while the watchdog is used as an async context manager, declares the peer dead as soon
+    as `timeout` seconds passed without a message; the next message makes it alive again. `on_change` is called with
+    the new state on every transition. When entering the context, the peer is considered alive.
+
+    To detect dead peers quickly, the peer should send messages (e.g. heartbeats) more often than `timeout`.
+    """
+
+    ALIVE = 'alive'
+    DEAD = 'dead'
+
+    def __init__(self, timeout: float, *, on_change: Callable[[str], None]=None) -> None:
+        self.timeout = timeout
+        self.on_change = on_change
+        self.state = self.ALIVE
+        self.last_message = 0.0
+        self._loop = None  # type: Optional[asyncio.AbstractEventLoop]
+        self._task = None  # type: Optional[asyncio.Task]
+
+    async def __aenter__(self) -> 'Watchdog':
+        # created here, so that they belong to the running loop
+        self._loop = asyncio.get_event_loop()
+        self._alive = asyncio.Event()
+        self.touch()
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        task = self._task
+        if task is None:
+            raise RuntimeError("Watchdog was not started")
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def _time(self) -> float:
+        if self._loop is None:
+            raise RuntimeError("Watchdog was not started")
+        return self._loop.time()
+
+    @property
+    def since_last_message(self) -> float:
+        """
+        The time since the last message; only available while the watchdog is running.
+        """
+        return self._time() - self.last_message
+
+    def _set_state(self, state: str) -> None:
+        if self.state != state:
+            self.state = state
+            if self.on_change is not None:
+                self.on_change(state)
+
+    def touch(self) -> None:
+        """
+        Records that a message was received from the peer just now.
+        Before the watchdog is started, this only marks the peer alive; entering the context records a message anyway.
+        """
+        self._set_state(self.ALIVE)
+        if self._loop is not None:
+            self.last_message = self._loop.time()
+            self._alive.set()
+
+    async def recv_multipart(self, socket: Any, *args, **kwargs) -> List[bytes]:
+        """
+        Receives a multipart message from the peer's socket and records it.
+        The socket may be an asyncio or a trio `Socket`.
+        """
+        frames = await zmq.asyncio.Socket.recv_multipart(socket, *args, **kwargs)  # type: List[bytes]
+        self.touch()
+        return frames
+
+    async def _run(self) -> None:
+        while True:
+            await self._alive.wait()
+            delay = self.last_message + self.timeout - self._time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                self._alive.clear()
+                self._set_state(self.DEAD)
@@ -0,0 +1,215 @@
+from typing import Callable, Deque, Dict, List, Tuple
+
+import heapq
+import itertools
+import math
+import threading
+import time
+import zmq
+from collections import deque
+
+from . import Context, Socket
+
+__all__ = ['Timer', 'Reactor']
+
+Handler = Callable[[List[bytes]], None]
+
+_reactor_ids = itertools.count()
+
+
+class Timer:
+    """
+    A callback scheduled on a `Reactor`. A repeating timer is rescheduled `interval` seconds after its deadline,
+    so that it doesn't drift when callbacks run late.
+    """
+
+    def __init__(self, deadline: float, interval: float, callback: Callable[[], None]) -> None:
+        self.deadline = deadline
+        self.interval = interval
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class Reactor:
+    """
+    Services many synchronous sockets from a single thread, for code that can't use asyncio or trio.
+
+    Sockets are registered together with a handler that is called for every received multipart message. A single
+    poll covers all sockets; every ready socket is then drained of at most `batch` messages without polling again,
+    and sockets that were served move to the back of the queue, so that one busy socket can't starve the others.
+    Timers are run between polls, and the poll timeout is chosen so that they run on time.
+
+    The reactor itself is not thread safe, except for `call_soon_threadsafe`, `wake` and `stop`: these wake up the
+    reactor through an inproc PAIR socket, so other threads don't have to wait for the next message or timer.
+    """
+
+    def __init__(self, ctx: Context, *, batch: int=64, clock: Callable[[], float]=time.monotonic) -> None:
+        self.ctx = ctx
+        self.batch = batch
+        self.clock = clock
+        self._handlers = {}  # type: Dict[Socket, Handler]
+        self._order = []  # type: List[Socket]
+        self._poller = zmq.Poller()
+        self._timers = []  # type: List[Tuple[float, int, Timer]]
+        self._timer_ids = itertools.count()
+        self._callbacks = deque()  # type: Deque[Callable[[], None]]
+        self._lock = threading.Lock()
+        self._woken = False
+        self._running = False
+
+        endpoint = f'inproc://hedgehog-reactor-{next(_reactor_ids)}'
+        self._wake_recv = ctx.socket(zmq.PAIR).configure(linger=0)
+        self._wake_send = ctx.socket(zmq.PAIR).configure(linger=0)
+        self._wake_recv.bind(endpoint)
+        self._wake_send.connect(endpoint)
+        self._poller.register(self._wake_recv, zmq.POLLIN)
+
+    def register(self, socket: Socket, handler: Handler) -> None:
+        """
+        Calls `handler` with every multipart message received on `socket`;
+        registering a socket again replaces its handler.
+        """
+        if socket not in self._handlers:
+            self._order.append(socket)
+            self._poller.register(socket, zmq.POLLIN)
+        self._handlers[socket] = handler
+
+    def unregister(self, socket: Socket) -> None:
+        """
+        Stops receiving from `socket`; messages that were already received in the current batch are discarded.
+        """
+        del self._handlers[socket]
+        self._order.remove(socket)
+        self._poller.unregister(socket)
+
+    def _schedule(self, timer: Timer) -> Timer:
+        heapq.heappush(self._timers, (timer.deadline, next(self._timer_ids), timer))
+        return timer
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> Timer:
+        """
+        Calls `callback` once, after `delay` seconds.
+        """
+        return self._schedule(Timer(self.clock() + delay, 0, callback))
+
+    def call_every(self, interval: float, callback: Callable[[], None]) -> Timer:
+        """
+        Calls `callback` every `interval` seconds, starting after the first interval, until the timer is cancelled.
+        """
+        return self._schedule(Timer(self.clock() + interval, interval, callback))
+
+    def call_soon_threadsafe(self, callback: Callable[[], None]) -> None:
+        """
+        Calls `callback` in the reactor's thread, waking it up if it is waiting. This may be called from any thread;
+        wakeups are coalesced, so that at most one wake message is pending at a time.
+        """
+        with self._lock:
+            self._callbacks.append(callback)
+            if not self._woken:
+                self._woken = True
+                self._wake_send.send(b'')
+
+    def wake(self) -> None:
+        """
+        Makes the reactor return from its current poll; may be called from any thread.
+        """
+        self.call_soon_threadsafe(lambda: None)
+
+    def stop(self) -> None:
+        """
+        Makes `run` return after the current iteration; may be called from any thread.
+        """
+        self.call_soon_threadsafe(self._stop)
+
+    def _stop(self) -> None:
+        self._running = False
+
+    def _poll_timeout(self, timeout: float=None) -> int:
+        # the poll timeout in milliseconds, -1 meaning no timeout
+        while self._timers and self._timers[0][2].cancelled:
+            heapq.heappop(self._timers)
+        if self._timers:
+            remaining = max(self._timers[0][0] - self.clock(), 0)
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return -1 if timeout is None else math.ceil(timeout * 1000)
+
+    def _run_callbacks(self) -> None:
+        with self._lock:
+            self._wake_recv.recv()
+            self._woken = False
+            callbacks = list(self._callbacks)
+            self._callbacks.clear()
+        for callback in callbacks:
+            callback()
+
+    def _run_timers(self) -> None:
+        now = self.clock()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, timer = heapq.heappop(self._timers)
+            if timer.cancelled:
+                continue
+            if timer.interval:
+                timer.deadline += timer.interval
+                self._schedule(timer)
+            timer.callback()
+
+    def _drain(self, ready: Dict[Socket, int]) -> int:
+        count = 0
+        served = []
+        for socket in list(self._order):
+            if not ready.get(socket, 0) & zmq.POLLIN:
+                continue
+            for _ in range(self.batch):
+                # an earlier handler may have unregistered the socket
+                handler = self._handlers.get(socket)
+                if handler is None:
+                    break
+                try:
+                    frames = socket.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                handler(frames)
+                count += 1
+            served.append(socket)
+        self._order = [socket for socket in self._order if socket not in served] + \
+                      [socket for socket in served if socket in self._handlers]
+        return count
+
+    def run_once(self, timeout: float=None) -> int:
+        """
+        Waits at most `timeout` seconds (or until the next timer is due) for any socket to become ready,
+        then handles received messages, wakeup callbacks and due timers. Returns the number of messages handled.
+        """
+        ready = dict(self._poller.poll(self._poll_timeout(timeout)))
+        if ready.pop(self._wake_recv, 0) & zmq.POLLIN:
+            self._run_callbacks()
+        count = self._drain(ready)
+        self._run_timers()
+        return count
+
+    def run(self) -> None:
+        """
+        Runs the reactor until `stop` is called.
+        """
+        self._running = True
+        while self._running:
+            self.run_once()
+
+    def close(self) -> None:
+        """
+        Closes the reactor's wakeup sockets; the registered sockets are left open.
+        """
+        for socket in list(self._order):
+            self.unregister(socket)
+        self._poller.unregister(self._wake_recv)
+        self._wake_recv.close()
+        self._wake_send.close()
+
+    def __enter__(self) -> 'Reactor':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
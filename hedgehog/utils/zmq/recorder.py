@@ -0,0 +1,295 @@
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+import asyncio
+import bisect
+import math
+import mmap
+import os
+import struct
+import time
+
+__all__ = ['Entry', 'Recorder', 'Recording', 'replay', 'replay_async']
+
+Discriminator = Callable[[Sequence[bytes]], bytes]
+
+_MAGIC = b'HHREC\x00\x01\x00'
+_RECORD_HEADER = struct.Struct('<dHI')
+_FRAME_HEADER = struct.Struct('<I')
+_INDEX_ENTRY = struct.Struct('<dQ')
+
+
+def _index_path(path: str) -> str:
+    return path + '.idx'
+
+
+class Entry(NamedTuple):
+    timestamp: float
+    discriminator: bytes
+    frames: List[bytes]
+
+
+class Recorder:
+    """
+    Appends timestamped multipart messages to a memory mapped log file.
+
+    Next to the log, an index file holds a `(timestamp, offset)` pair per message, which allows a `Recording` to seek
+    to a point in time without scanning the log. Every message is also tagged with a discriminator, computed from its
+    frames by the `discriminator` function, e.g. the message type or topic.
+    """
+
+    def __init__(self, path: str, *, discriminator: Discriminator=None,
+                 clock: Callable[[], float]=time.monotonic, chunk_size: int=1 << 20) -> None:
+        self.path = path
+        self.discriminator = discriminator
+        self.clock = clock
+        self.chunk_size = chunk_size
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self._capacity = self._chunks(len(_MAGIC))
+        os.ftruncate(self._fd, self._capacity)
+        self._mmap = mmap.mmap(self._fd, self._capacity)
+        self._closed = False
+        self._mmap[:len(_MAGIC)] = _MAGIC
+        self._size = len(_MAGIC)
+        self._index = open(_index_path(path), 'wb')
+
+    def _chunks(self, required: int) -> int:
+        return (required // self.chunk_size + 1) * self.chunk_size
+
+    def _grow(self, required: int) -> None:
+        if required <= self._capacity:
+            return
+        self._mmap.close()
+        self._capacity = self._chunks(required)
+        os.ftruncate(self._fd, self._capacity)
+        self._mmap = mmap.mmap(self._fd, self._capacity)
+
+    def record(self, frames: Sequence[bytes], timestamp: float=None) -> None:
+        """
+        Appends a message to the log; if no timestamp is given, the recorder's clock is used.
+        """
+        if timestamp is None:
+            timestamp = self.clock()
+        discriminator = self.discriminator(frames) if self.discriminator is not None else b''
+
+        size = _RECORD_HEADER.size + len(discriminator) + sum(_FRAME_HEADER.size + len(frame) for frame in frames)
+        offset = self._size
+        self._grow(offset + size)
+        mm = self._mmap
+
+        _RECORD_HEADER.pack_into(mm, offset, timestamp, len(discriminator), len(frames))
+        pos = offset + _RECORD_HEADER.size
+        mm[pos:pos + len(discriminator)] = discriminator
+        pos += len(discriminator)
+        for frame in frames:
+            _FRAME_HEADER.pack_into(mm, pos, len(frame))
+            pos += _FRAME_HEADER.size
+            mm[pos:pos + len(frame)] = frame
+            pos += len(frame)
+
+        self._size = pos
+        self._index.write(_INDEX_ENTRY.pack(timestamp, offset))
+
+    def flush(self) -> None:
+        """
+        Writes the log and index to disk, so that a `Recording` opened in the meantime sees all messages.
+        """
+        self._mmap.flush()
+        self._index.flush()
+
+    def recv_multipart(self, socket: Any, *args, **kwargs) -> List[bytes]:
+        """
+        Receives a multipart message from a synchronous socket and records it.
+        """
+        frames = socket.recv_multipart(*args, **kwargs)  # type: List[bytes]
+        self.record(frames)
+        return frames
+
+    async def recv_multipart_async(self, socket: Any, *args, **kwargs) -> List[bytes]:
+        """
+        Receives a multipart message from an asyncio or trio socket and records it.
+        """
+        frames = await socket.recv_multipart(*args, **kwargs)  # type: List[bytes]
+        self.record(frames)
+        return frames
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._mmap.flush()
+        self._mmap.close()
+        # drop the unused preallocated space
+        os.ftruncate(self._fd, self._size)
+        os.close(self._fd)
+        self._index.close()
+
+    def __enter__(self) -> 'Recorder':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+class _Timestamps(Sequence[float]):
+    # exposes the timestamps of the index for bisecting
+
+    def __init__(self, index: memoryview) -> None:
+        self._index = index
+
+    def __len__(self) -> int:
+        return len(self._index) // _INDEX_ENTRY.size
+
+    def __getitem__(self, i):
+        return _INDEX_ENTRY.unpack_from(self._index, i * _INDEX_ENTRY.size)[0]
+
+
+class Recording:
+    """
+    Read access to a log written by a `Recorder`. Both the log and its index are memory mapped.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._mmaps = []  # type: List[mmap.mmap]
+        self._views = []  # type: List[memoryview]
+        self._log = self._map(path)
+        if self._log[:len(_MAGIC)] != _MAGIC:
+            self.close()
+            raise ValueError(f"{path!r} is not a recording")
+        self._index = self._map(_index_path(path))
+        self._timestamps = _Timestamps(self._index)
+        self._by_discriminator = None  # type: Optional[Dict[bytes, List[int]]]
+
+    def _map(self, path: str) -> memoryview:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b'')
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mm)
+        self._mmaps.append(mm)
+        self._views.append(view)
+        return view
+
+    def __len__(self) -> int:
+        return len(self._timestamps)
+
+    def _offset(self, i: int) -> int:
+        _, offset = _INDEX_ENTRY.unpack_from(self._index, i * _INDEX_ENTRY.size)  # type: float, int
+        return offset
+
+    def _discriminator(self, i: int) -> bytes:
+        offset = self._offset(i)
+        _, length, _ = _RECORD_HEADER.unpack_from(self._log, offset)
+        offset += _RECORD_HEADER.size
+        return bytes(self._log[offset:offset + length])
+
+    def __getitem__(self, i: int) -> Entry:
+        offset = self._offset(i)
+        timestamp, length, count = _RECORD_HEADER.unpack_from(self._log, offset)
+        pos = offset + _RECORD_HEADER.size
+        discriminator = bytes(self._log[pos:pos + length])
+        pos += length
+        frames = []
+        for _ in range(count):
+            frame_len, = _FRAME_HEADER.unpack_from(self._log, pos)
+            pos += _FRAME_HEADER.size
+            frames.append(bytes(self._log[pos:pos + frame_len]))
+            pos += frame_len
+        return Entry(timestamp, discriminator, frames)
+
+    def seek(self, timestamp: float) -> int:
+        """
+        Returns the index of the first message recorded at or after the given timestamp.
+        """
+        return bisect.bisect_left(self._timestamps, timestamp)
+
+    def discriminators(self) -> Dict[bytes, List[int]]:
+        """
+        Returns the indices of all messages, grouped by discriminator.
+        The grouping is computed on first use, reading only the record headers.
+        """
+        if self._by_discriminator is None:
+            self._by_discriminator = {}
+            for i in range(len(self)):
+                self._by_discriminator.setdefault(self._discriminator(i), []).append(i)
+        return self._by_discriminator
+
+    def entries(self, start: float=None, end: float=None, discriminator: bytes=None) -> Iterator[Entry]:
+        """
+        Yields the messages recorded in the time range `[start, end)`, optionally only those with the given
+        discriminator.
+        """
+        lo = self.seek(start) if start is not None else 0
+        hi = self.seek(end) if end is not None else len(self)
+        if discriminator is None:
+            indices = range(lo, hi)  # type: Sequence[int]
+        else:
+            group = self.discriminators().get(discriminator, [])
+            indices = group[bisect.bisect_left(group, lo):bisect.bisect_left(group, hi)]
+        for i in indices:
+            yield self[i]
+
+    def close(self) -> None:
+        self._log = self._index = memoryview(b'')
+        self._timestamps = _Timestamps(self._index)
+        for view in self._views:
+            view.release()
+        for mm in self._mmaps:
+            mm.close()
+        self._views.clear()
+        self._mmaps.clear()
+
+    def __enter__(self) -> 'Recording':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+def _schedule(entries: Iterator[Entry], speed: float) -> Iterator[Any]:
+    # yields (delay relative to the first message, frames) pairs
+    first = None
+    for entry in entries:
+        if first is None:
+            first = entry.timestamp
+        delay = 0 if math.isinf(speed) else (entry.timestamp - first) / speed
+        yield delay, entry.frames
+
+
+def replay(recording: Recording, socket: Any, *, speed: float=1, clock: Callable[[], float]=time.monotonic,
+           sleep: Callable[[float], None]=time.sleep, **kwargs) -> int:
+    """
+    Sends the recorded messages to a synchronous socket, keeping their original spacing divided by `speed`;
+    `speed=math.inf` sends all messages without waiting. The remaining keyword arguments select messages as in
+    `Recording.entries`. Returns the number of messages sent.
+    """
+    count = 0
+    begin = clock()
+    for delay, frames in _schedule(recording.entries(**kwargs), speed):
+        remaining = begin + delay - clock()
+        if remaining > 0:
+            sleep(remaining)
+        socket.send_multipart(frames)
+        count += 1
+    return count
+
+
+async def replay_async(recording: Recording, socket: Any, *, speed: float=1, clock: Callable[[], float]=None,
+                       sleep: Callable[[float], Awaitable[None]]=asyncio.sleep, **kwargs) -> int:
+    """
+    Sends the recorded messages to an asyncio socket, like `replay`. The event loop's clock is used, so that on a
+    `SelectorTimeTrackingTestLoop`, replay happens deterministically in virtual time.
+    For trio sockets, pass `clock=trio.current_time` and `sleep=trio.sleep`.
+    """
+    if clock is None:
+        clock = asyncio.get_event_loop().time
+    count = 0
+    begin = clock()
+    for delay, frames in _schedule(recording.entries(**kwargs), speed):
+        remaining = begin + delay - clock()
+        if remaining > 0:
+            await sleep(remaining)
+        await socket.send_multipart(frames)
+        count += 1
+    return count
@@ -0,0 +1,335 @@
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import mmap
+import os
+import struct
+import tempfile
+import time
+import uuid
+import zmq
+
+__all__ = ['SlotBuffer', 'SharedPayload', 'SharedMemoryChannel', 'is_local_endpoint']
+
+Frame = Union[bytes, memoryview]
+
+MAGIC = b'\x00hedgehog-shm\x00'
+
+_FILE_HEADER = struct.Struct('<16sII')
+_FILE_MAGIC = b'hedgehog-slots\x00\x00'
+# the generation written by the sender, and the last generation released by the receiver
+_SLOT_HEADER = struct.Struct('<II')
+_DESCRIPTOR_HEADER = struct.Struct('<H')
+# frame index, slot, length, generation
+_DESCRIPTOR_ENTRY = struct.Struct('<IIII')
+
+# socket types that deliver a message to more than one peer; a slot can only be released by a single receiver
+_FAN_OUT_TYPES = {zmq.PUB, zmq.XPUB} | {getattr(zmq, name) for name in ('RADIO',) if hasattr(zmq, name)}
+
+
+def is_local_endpoint(endpoint: str) -> bool:
+    """
+    Returns whether the given zmq endpoint can only be reached from the same host,
+    i.e. whether payloads sent to it may be placed in shared memory.
+
+        >>> is_local_endpoint('ipc:///tmp/hedgehog')
+        True
+        >>> is_local_endpoint('tcp://127.0.0.1:10789')
+        False
+    """
+    return endpoint.split('://', 1)[0] in {'ipc', 'inproc'}
+
+
+def _shm_directory() -> str:
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+class SlotBuffer:
+    """
+    A memory mapped file divided into fixed size slots, used as a ring buffer for large payloads.
+
+    Every slot starts with a small header holding two generation numbers. The process that created the buffer
+    increments the slot's generation when it writes a payload into it; the receiving process stores that generation as
+    released when it is done with the payload. A slot is free while both numbers are equal. As every field has exactly
+    one writer, no cross process locking is necessary, and a late release of a slot that was reused in the meantime
+    has no effect.
+
+    Slots whose payloads are never released, e.g. because zmq dropped the message, are reclaimed by the owner after
+    `reclaim_timeout` seconds. Receivers must release or copy payloads before that; `generation` tells them whether a
+    slot was reused.
+    """
+
+    def __init__(self, path: str, mm: mmap.mmap, slot_size: int, slots: int, owner: bool, *,
+                 reclaim_timeout: float=None, clock: Callable[[], float]=time.monotonic) -> None:
+        self.path = path
+        self.slot_size = slot_size
+        self.slots = slots
+        self.reclaim_timeout = reclaim_timeout
+        self.clock = clock
+        self._mmap = mm
+        self._owner = owner
+        self._next = 0
+        self._allocated = [0.0] * slots
+
+    @classmethod
+    def create(cls, slot_size: int=1 << 20, slots: int=16, directory: str=None, **kwargs) -> 'SlotBuffer':
+        """
+        Creates a new buffer file with the given geometry; the creating process owns the buffer and removes the file
+        on `close()`. The keyword arguments configure slot reclamation.
+        """
+        path = os.path.join(directory or _shm_directory(), f'hedgehog-{uuid.uuid4().hex}')
+        size = _FILE_HEADER.size + slots * (_SLOT_HEADER.size + slot_size)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            os.ftruncate(fd, size)
+            mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        _FILE_HEADER.pack_into(mm, 0, _FILE_MAGIC, slot_size, slots)
+        return cls(path, mm, slot_size, slots, owner=True, **kwargs)
+
+    @classmethod
+    def attach(cls, path: str) -> 'SlotBuffer':
+        """
+        Maps an existing buffer file, reading its geometry from the file header.
+        """
+        fd = os.open(path, os.O_RDWR)
+        try:
+            mm = mmap.mmap(fd, os.fstat(fd).st_size)
+        finally:
+            os.close(fd)
+        magic, slot_size, slots = _FILE_HEADER.unpack_from(mm, 0)
+        if magic != _FILE_MAGIC:
+            mm.close()
+            raise ValueError(f"{path!r} is not a slot buffer")
+        return cls(path, mm, slot_size, slots, owner=False)
+
+    def _offset(self, slot: int) -> int:
+        return _FILE_HEADER.size + slot * (_SLOT_HEADER.size + self.slot_size)
+
+    def generation(self, slot: int) -> int:
+        return int(_SLOT_HEADER.unpack_from(self._mmap, self._offset(slot))[0])
+
+    def is_free(self, slot: int) -> bool:
+        generation, released = _SLOT_HEADER.unpack_from(self._mmap, self._offset(slot))
+        return bool(generation == released)
+
+    def _reclaimable(self, slot: int, now: float) -> bool:
+        return self.reclaim_timeout is not None and now - self._allocated[slot] >= self.reclaim_timeout
+
+    def allocate(self) -> Optional[int]:
+        """
+        Returns the next free or reclaimable slot in ring order and starts its next generation,
+        or `None` if all slots are in use.
+        """
+        now = self.clock()
+        for i in range(self.slots):
+            slot = (self._next + i) % self.slots
+            if self.is_free(slot) or self._reclaimable(slot, now):
+                offset = self._offset(slot)
+                generation = (self.generation(slot) + 1) & 0xFFFFFFFF
+                self._mmap[offset:offset + 4] = generation.to_bytes(4, 'little')
+                self._allocated[slot] = now
+                self._next = (slot + 1) % self.slots
+                return slot
+        return None
+
+    def write(self, slot: int, data: Frame) -> None:
+        offset = self._offset(slot) + _SLOT_HEADER.size
+        self._mmap[offset:offset + len(data)] = data
+
+    def view(self, slot: int, length: int) -> memoryview:
+        offset = self._offset(slot) + _SLOT_HEADER.size
+        return memoryview(self._mmap)[offset:offset + length]
+
+    def release(self, slot: int, generation: int) -> None:
+        """
+        Marks the given generation of the slot as released, so that the owner may reuse the slot.
+        """
+        offset = self._offset(slot) + 4
+        self._mmap[offset:offset + 4] = generation.to_bytes(4, 'little')
+
+    def close(self) -> None:
+        self._mmap.close()
+        if self._owner:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:  # pragma: nocover
+                pass
+
+    def __enter__(self) -> 'SlotBuffer':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+class SharedPayload:
+    """
+    A received payload that still lives in the sender's slot buffer.
+
+    The payload starts with one reference; every `acquire()` adds one, every `release()` removes one. When the last
+    reference is released, the slot is handed back to the sender. The payload's `data` must not be used after that,
+    nor after the sender reclaimed the slot, which `valid` reports.
+    """
+
+    def __init__(self, buffer: SlotBuffer, slot: int, length: int, generation: int) -> None:
+        self._buffer = buffer
+        self._slot = slot
+        self.generation = generation
+        self.data = buffer.view(slot, length)
+        self.refcount = 1
+
+    @property
+    def valid(self) -> bool:
+        return self._buffer.generation(self._slot) == self.generation
+
+    def acquire(self) -> 'SharedPayload':
+        if self.refcount <= 0:
+            raise RuntimeError("payload was already released")
+        self.refcount += 1
+        return self
+
+    def release(self) -> None:
+        if self.refcount <= 0:
+            raise RuntimeError("payload was already released")
+        self.refcount -= 1
+        if self.refcount == 0:
+            self.data.release()
+            self._buffer.release(self._slot, self.generation)
+
+    def __bytes__(self) -> bytes:
+        data = bytes(self.data)
+        # the copy is only consistent if the slot was not reclaimed while copying
+        if not self.valid:
+            raise RuntimeError("payload slot was reclaimed by the sender")
+        return data
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __enter__(self) -> 'SharedPayload':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.release()
+
+
+class SharedMemoryChannel:
+    """
+    Moves large frames of multipart messages out of band through a `SlotBuffer`.
+
+    `pack` replaces every frame of at least `threshold` bytes with an empty frame, writes its contents into a free slot
+    and prepends a marker frame and a small descriptor frame locating the payloads. `unpack` reverses this on the
+    receiving side. Messages without large frames, frames that don't fit a slot, and all frames while the ring is full
+    are sent as-is, as are all frames of a disabled channel; `unpack` accepts both forms.
+
+    A channel is used either for sending or for receiving. Create sending channels via `for_endpoint`, which disables
+    the side channel for endpoints that may be on another host. Slots not released within `reclaim_timeout` seconds
+    are reused by the sender, see `SlotBuffer`.
+    """
+
+    def __init__(self, *, threshold: int=1 << 16, slot_size: int=1 << 20, slots: int=16, enabled: bool=True,
+                 reclaim_timeout: float=10, clock: Callable[[], float]=time.monotonic) -> None:
+        self.threshold = threshold
+        self.slot_size = slot_size
+        self.slots = slots
+        self.enabled = enabled
+        self.reclaim_timeout = reclaim_timeout
+        self.clock = clock
+        self._buffer = None  # type: Optional[SlotBuffer]
+        self._attached = {}  # type: Dict[str, SlotBuffer]
+
+    @classmethod
+    def for_endpoint(cls, endpoint: str, socket_type: int=None, **kwargs) -> 'SharedMemoryChannel':
+        """
+        Creates a sending channel for a socket of the given type that is bound or connected to `endpoint`.
+        Socket types that deliver a message to more than one peer, such as PUB, are refused with a `ValueError`.
+        """
+        if socket_type in _FAN_OUT_TYPES:
+            raise ValueError(f"shared memory payloads can't be sent to more than one peer (socket type {socket_type})")
+        return cls(enabled=is_local_endpoint(endpoint), **kwargs)
+
+    @property
+    def buffer(self) -> SlotBuffer:
+        if self._buffer is None:
+            self._buffer = SlotBuffer.create(self.slot_size, self.slots,
+                                             reclaim_timeout=self.reclaim_timeout, clock=self.clock)
+        return self._buffer
+
+    def pack(self, frames: Sequence[Frame]) -> List[Frame]:
+        result = list(frames)
+        if not self.enabled:
+            return result
+
+        entries = []  # type: List[Tuple[int, int, int, int]]
+        for i, frame in enumerate(result):
+            length = len(frame)
+            if not self.threshold <= length <= self.slot_size:
+                continue
+            slot = self.buffer.allocate()
+            if slot is None:
+                break
+            self.buffer.write(slot, memoryview(frame))
+            entries.append((i, slot, length, self.buffer.generation(slot)))
+            result[i] = b''
+
+        if not entries:
+            return result
+
+        path = self.buffer.path.encode()
+        descriptor = b''.join([
+            _DESCRIPTOR_HEADER.pack(len(path)), path,
+            *(_DESCRIPTOR_ENTRY.pack(*entry) for entry in entries),
+        ])
+        return [MAGIC, descriptor, *result]
+
+    def unpack(self, frames: Sequence[Frame], copy: bool=True) -> List[Union[Frame, SharedPayload]]:
+        """
+        Restores the original frames of a message created by `pack`.
+        With `copy=False`, out of band frames are returned as `SharedPayload`s that must be released by the caller.
+        Raises a `ValueError` for descriptors that don't match the slot buffer, and a `RuntimeError` if a payload's slot
+        was already reclaimed by the sender.
+        """
+        if len(frames) < 2 or len(frames[0]) != len(MAGIC) or bytes(frames[0]) != MAGIC:
+            return list(frames)
+
+        descriptor = bytes(frames[1])
+        if len(descriptor) < _DESCRIPTOR_HEADER.size:
+            raise ValueError("invalid shared memory descriptor length")
+        path_len, = _DESCRIPTOR_HEADER.unpack_from(descriptor, 0)
+        offset = _DESCRIPTOR_HEADER.size + path_len
+        if len(descriptor) < offset or (len(descriptor) - offset) % _DESCRIPTOR_ENTRY.size:
+            raise ValueError("invalid shared memory descriptor length")
+        path = descriptor[_DESCRIPTOR_HEADER.size:offset].decode()
+
+        buffer = self._attached.get(path)
+        if buffer is None:
+            buffer = self._attached[path] = SlotBuffer.attach(path)
+
+        result = list(frames[2:])  # type: List[Union[Frame, SharedPayload]]
+        for i, slot, length, generation in _DESCRIPTOR_ENTRY.iter_unpack(descriptor[offset:]):
+            if i >= len(result) or slot >= buffer.slots or length > buffer.slot_size:
+                raise ValueError(f"invalid shared memory descriptor entry: frame {i}, slot {slot}, length {length}")
+            if buffer.generation(slot) != generation:
+                raise RuntimeError("payload slot was reclaimed by the sender")
+            payload = SharedPayload(buffer, slot, length, generation)
+            if copy:
+                with payload:
+                    result[i] = bytes(payload)
+            else:
+                result[i] = payload
+        return result
+
+    def close(self) -> None:
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer = None
+        for buffer in self._attached.values():
+            buffer.close()
+        self._attached.clear()
+
+    def __enter__(self) -> 'SharedMemoryChannel':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
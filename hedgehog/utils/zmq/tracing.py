@@ -0,0 +1,169 @@
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import bisect
+import itertools
+import os
+import struct
+import time
+
+__all__ = ['Hop', 'Trace', 'Histogram', 'Tracer']
+
+Frame = bytes
+
+MAGIC = b'\x00hedgehog-trace\x00'
+
+_TRACE_HEADER = struct.Struct('<Q')
+_HOP_HEADER = struct.Struct('<dB')
+
+# bucket upper bounds in seconds, from 10us to 10s
+DEFAULT_BOUNDS = tuple(m * 10.0 ** e for e in range(-5, 1) for m in (1, 2, 5)) + (10.0,)
+
+
+class Hop(NamedTuple):
+    name: str
+    timestamp: float
+
+
+class Trace(NamedTuple):
+    trace_id: int
+    hops: List[Hop]
+
+    def latencies(self) -> List[Tuple[str, str, float]]:
+        """
+        Returns `(from, to, seconds)` for every pair of consecutive hops.
+        """
+        return [(a.name, b.name, b.timestamp - a.timestamp) for a, b in zip(self.hops, self.hops[1:])]
+
+    def total(self) -> float:
+        return self.hops[-1].timestamp - self.hops[0].timestamp
+
+
+class Histogram:
+    """
+    Counts values into buckets with fixed upper bounds; values above the last bound go into an overflow bucket.
+    """
+
+    def __init__(self, bounds: Sequence[float]=DEFAULT_BOUNDS) -> None:
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def record(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """
+        Returns the upper bound of the bucket containing the `q`-quantile; for the overflow bucket, the maximum value.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        for bound, cumulative in zip(self.bounds, itertools.accumulate(self.counts)):
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Tracer:
+    """
+    Adds a trace frame in front of multipart messages, carrying a trace id and a timestamp per hop,
+    and records latencies when receiving traced messages.
+
+    The sender calls `start`, intermediate processes may call `forward`, and the receiver calls `strip`, which removes
+    the trace frame, adds the final hop and records the latency of every hop and the end-to-end latency in histograms.
+    Hop timestamps are taken from `clock`, by default `time.monotonic`, which is only comparable between processes on
+    the same host.
+
+    A disabled tracer doesn't add trace frames, but still strips them from received messages without recording.
+
+    The trace frame is placed after the first `envelope` frames of a message, which are routing frames: e.g. on a
+    ROUTER socket, pass `envelope=1` for messages from and to DEALER peers, or `envelope=2` for REQ peers, whose
+    messages also contain an empty delimiter frame.
+
+    Frames may also be `zmq.Frame`s, as received with `copy=False`; other frames than the trace frame are passed on
+    unchanged.
+    """
+
+    def __init__(self, name: str, *, enabled: bool=True, clock: Callable[[], float]=time.monotonic,
+                 bounds: Sequence[float]=DEFAULT_BOUNDS) -> None:
+        self.name = name
+        self.enabled = enabled
+        self.clock = clock
+        self.bounds = bounds
+        self.hop_latency = {}  # type: Dict[Tuple[str, str], Histogram]
+        self.end_to_end = Histogram(bounds)
+        self._name = name.encode()
+
+    def _hop(self) -> bytes:
+        return _HOP_HEADER.pack(self.clock(), len(self._name)) + self._name
+
+    @staticmethod
+    def _is_traced(frames: Sequence[Frame], envelope: int) -> bool:
+        # a memoryview also covers `zmq.Frame`s, which are received with `copy=False` and can't be sliced
+        return len(frames) > envelope and memoryview(frames[envelope])[:len(MAGIC)] == MAGIC
+
+    def start(self, frames: Sequence[Frame], trace_id: int=None, *, envelope: int=0) -> Sequence[Frame]:
+        """
+        Adds a trace frame with a first hop to a message; a disabled tracer returns the frames unchanged.
+        """
+        if not self.enabled:
+            return frames
+        if trace_id is None:
+            trace_id = int.from_bytes(os.urandom(8), 'little')
+        trace_frame = MAGIC + _TRACE_HEADER.pack(trace_id) + self._hop()
+        return [*frames[:envelope], trace_frame, *frames[envelope:]]
+
+    def forward(self, frames: Sequence[Frame], *, envelope: int=0) -> Sequence[Frame]:
+        """
+        Adds a hop to a traced message that is passed on.
+        """
+        if not self.enabled or not self._is_traced(frames, envelope):
+            return frames
+        return [*frames[:envelope], memoryview(frames[envelope]).tobytes() + self._hop(), *frames[envelope + 1:]]
+
+    def strip(self, frames: Sequence[Frame], *, envelope: int=0) -> Tuple[List[Frame], Optional[Trace]]:
+        """
+        Removes the trace frame of a message, if any, and records its latencies.
+        Returns the remaining frames, including the envelope, and the trace, including a hop for this tracer.
+        """
+        if not self._is_traced(frames, envelope):
+            return list(frames), None
+        remaining = [*frames[:envelope], *frames[envelope + 1:]]
+        if not self.enabled:
+            return remaining, None
+
+        trace = self.parse(memoryview(frames[envelope]).tobytes() + self._hop())
+        for a, b, latency in trace.latencies():
+            histogram = self.hop_latency.get((a, b))
+            if histogram is None:
+                histogram = self.hop_latency[a, b] = Histogram(self.bounds)
+            histogram.record(latency)
+        self.end_to_end.record(trace.total())
+        return remaining, trace
+
+    @staticmethod
+    def parse(trace_frame: bytes) -> Trace:
+        """
+        Decodes a trace frame; the hops make up the rest of the frame after the trace id.
+        """
+        offset = len(MAGIC)
+        trace_id, = _TRACE_HEADER.unpack_from(trace_frame, offset)
+        offset += _TRACE_HEADER.size
+        hops = []
+        while offset < len(trace_frame):
+            timestamp, length = _HOP_HEADER.unpack_from(trace_frame, offset)
+            offset += _HOP_HEADER.size
+            hops.append(Hop(trace_frame[offset:offset + length].decode(), timestamp))
+            offset += length
+        return Trace(trace_id, hops)
@@ -1,12 +1,13 @@
-from typing import Union
+from typing import AsyncIterator, List, Sequence, Tuple, Union
 
 import zmq.asyncio
 
 from trio_asyncio import aio_as_trio
 
-from . import _ConfigureSocketMixin, _AsyncSocketExtensionsMixin
+from . import _ConfigureSocketMixin, _AsyncSocketExtensionsMixin, _merge_multipart
+from . import asyncio as _asyncio
 
-__all__ = ['Context', 'Socket', 'Fileno', 'SocketLike']
+__all__ = ['Context', 'Socket', 'Fileno', 'SocketLike', 'merge', 'SendPipeline', 'DualLaneSocket', 'Watchdog']
 
 
 class Socket(_ConfigureSocketMixin, _AsyncSocketExtensionsMixin, zmq.asyncio.Socket):
@@ -41,3 +42,76 @@ class Context(zmq.Context):
 
 Fileno = int
 SocketLike = Union[Socket, Fileno]
+
+
+async def merge(*sockets: Socket, batch: int=1) -> AsyncIterator[Tuple[Socket, List[bytes]]]:
+    """
+    Yields `(socket, frames)` for multipart messages received on any of the given sockets, waiting on all of them
+    through a single poller. Sockets are served round-robin, at most `batch` messages at a time.
+    """
+    poller = zmq.asyncio.Poller()
+    for socket in sockets:
+        poller.register(socket, zmq.POLLIN)
+
+    async for item in _merge_multipart(aio_as_trio(poller.poll), sockets, batch):
+        yield item
+
+
+class SendPipeline(_asyncio.SendPipeline):
+    """
+    Coalesces `send_multipart` calls from any number of tasks, see `hedgehog.utils.zmq.asyncio.SendPipeline`;
+    trio version. The flusher runs on the trio-asyncio loop, which must be open while the pipeline is used.
+    """
+
+    @aio_as_trio
+    def __aenter__(self):
+        return super().__aenter__()
+
+    @aio_as_trio
+    def __aexit__(self, exc_type, exc_val, exc_tb):
+        return super().__aexit__(exc_type, exc_val, exc_tb)
+
+    @aio_as_trio
+    def send_multipart(self, frames: Sequence[bytes]):
+        return super().send_multipart(frames)
+
+    @aio_as_trio
+    def flush(self):
+        return super().flush()
+
+
+class DualLaneSocket(_asyncio.DualLaneSocket):
+    """
+    Combines a control and a bulk socket, see `hedgehog.utils.zmq.asyncio.DualLaneSocket`; trio version.
+    """
+
+    @aio_as_trio
+    def send_control(self, frames: Sequence[bytes]):
+        return super().send_control(frames)
+
+    @aio_as_trio
+    def send_bulk(self, frames: Sequence[bytes]):
+        return super().send_bulk(frames)
+
+    @aio_as_trio
+    def recv_multipart(self):
+        return super().recv_multipart()
+
+
+class Watchdog(_asyncio.Watchdog):
+    """
+    Tracks whether a peer is alive, see `hedgehog.utils.zmq.asyncio.Watchdog`; trio version.
+    The watchdog task runs on the trio-asyncio loop, so times are measured by that loop's clock.
+    """
+
+    @aio_as_trio
+    def __aenter__(self):
+        return super().__aenter__()
+
+    @aio_as_trio
+    def __aexit__(self, exc_type, exc_val, exc_tb):
+        return super().__aexit__(exc_type, exc_val, exc_tb)
+
+    @aio_as_trio
+    def recv_multipart(self, socket: Socket, *args, **kwargs):
+        return super().recv_multipart(socket, *args, **kwargs)
@@ -54,6 +54,7 @@ setup(
         'dev': ['invoke',
                 'pytest', 'pytest-runner', 'pytest-asyncio', 'pytest-trio', 'pytest-cov', 'pytest-timeout', 'mypy'],
         'protobuf': ['protobuf'],
+        'numpy': ['numpy'],
         'zmq': ['pyzmq'],
         'trio': ['trio', 'trio-asyncio'],
     },
@@ -4,3 +4,8 @@ from invoke import run, task
 @task
 def protoc(context):
     run("protoc --proto_path=proto --python_out=. `find proto -name '*.proto'`")
+
+
+@task
+def benchmark(context):
+    run("python benchmarks/reactor_vs_threads.py")
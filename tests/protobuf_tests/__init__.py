@@ -62,3 +62,34 @@ class SimpleTest(Message, SimpleMessageMixin):
 
     def _serialize(self, msg: test_pb2.SimpleTest) -> None:
         msg.field = self.field
+
+
+@Msg1.message(test_pb2.BlobTest, 'blob_test')
+@dataclass(frozen=True)
+class BlobTest(Message, SimpleMessageMixin):
+    data: bytes
+
+    @classmethod
+    def _parse(cls, msg: test_pb2.BlobTest) -> 'BlobTest':
+        data = msg.data
+        return cls(data)
+
+    def _serialize(self, msg: test_pb2.BlobTest) -> None:
+        msg.data = self.data
+
+
+@Msg1.message(test_pb2.FixedTest, 'fixed_test', layout='<Hf?')
+@dataclass(frozen=True)
+class FixedTest(Message, SimpleMessageMixin):
+    x: int
+    y: float
+    flag: bool
+
+    @classmethod
+    def _parse(cls, msg: test_pb2.FixedTest) -> 'FixedTest':
+        return cls(msg.x, msg.y, msg.flag)
+
+    def _serialize(self, msg: test_pb2.FixedTest) -> None:
+        msg.x = self.x
+        msg.y = self.y
+        msg.flag = self.flag
@@ -0,0 +1,57 @@
+import pytest
+
+import json
+import subprocess
+import sys
+
+
+MEASURE = """\
+import json, sys, time
+# the shared hedgehog namespace package is not part of the budget
+import hedgehog
+before = set(sys.modules)
+start = time.perf_counter()
+import {module}
+end = time.perf_counter()
+print(json.dumps({{'time': end - start, 'modules': sorted(set(sys.modules) - before)}}))
+"""
+
+HEAVY = {'aiostream', 'google', 'pkg_resources', 'pytest', 'trio', 'trio_asyncio', 'zmq'}
+
+
+def cold_import(module):
+    # a fresh interpreter, so that nothing is cached in sys.modules
+    output = subprocess.check_output([sys.executable, '-c', MEASURE.format(module=module)])
+    result = json.loads(output)
+    return result['time'], result['modules']
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.parametrize('module, max_time, max_modules, allowed', [
+    ('hedgehog.utils', 0.1, 20, set()),
+    ('hedgehog.utils.asyncio', 0.3, 120, set()),
+    ('hedgehog.utils.protobuf', 0.2, 40, set()),
+    ('hedgehog.utils.zmq', 0.3, 100, {'zmq'}),
+    ('hedgehog.utils.zmq.asyncio', 0.3, 100, {'zmq'}),
+    ('hedgehog.utils.zmq.trio', 0.6, 250, {'zmq', 'trio', 'trio_asyncio'}),
+])
+def test_import_budget(module, max_time, max_modules, allowed):
+    time, modules = cold_import(module)
+    heavy = {name for name in modules if name.split('.')[0] in HEAVY - allowed}
+    assert not heavy
+    assert len(modules) <= max_modules
+    assert time <= max_time
+
+
+def test_lazy_attributes():
+    import hedgehog.utils
+    import hedgehog.utils.zmq
+    import hedgehog.utils.asyncio
+
+    assert hedgehog.utils.zmq.shm.SharedMemoryChannel is not None
+    with pytest.raises(AttributeError):
+        hedgehog.utils.missing
+    with pytest.raises(AttributeError):
+        hedgehog.utils.zmq.missing
+    with pytest.raises(AttributeError):
+        hedgehog.utils.asyncio.missing
@@ -0,0 +1,35 @@
+import pytest
+from hedgehog.utils.test_utils import event_loop, zmq_aio_ctx, load_generator, assertPassed, assertCpuTime
+
+
+# Pytest fixtures
+event_loop, zmq_aio_ctx, load_generator
+
+
+@pytest.mark.asyncio
+async def test_load_generator(load_generator):
+    generator = load_generator(producers=2, consumers=2, rate=25, duration=2, payload=(b'foo', b'bar'))
+    with assertPassed(1.96):
+        report = await generator.run()
+
+    assert report.sent == 100
+    assert report.duration == 1.96
+    assert len(report.latencies) == 100
+    report.assert_budget(min_throughput=50, max_latency=0, max_cpu_time=0.4)
+
+    with pytest.raises(AssertionError):
+        report.assert_budget(min_throughput=1000)
+
+
+@pytest.mark.asyncio
+async def test_load_handler(load_generator):
+    received = []
+    generator = load_generator(rate=10, duration=1, payload=(b'foo',), handler=received.append)
+    with assertCpuTime(0.4):
+        report = await generator.run()
+    assert received == [[b'foo']] * 10
+    report.assert_budget(max_latency=0)
+
+    report = await load_generator(duration=0).run()
+    assert report.sent == report.received == 0
+    assert report.max_latency == 0
@@ -1,3 +1,11 @@
+import pytest
+
+import zlib
+from dataclasses import dataclass
+
+from hedgehog.utils.protobuf import message, ContainerMessage, Message, SimpleMessageMixin, DeltaEncoder, DeltaDecoder
+from hedgehog.utils.protobuf import Codec, codecs, Compression, LZMA, register_codec
+
 from . import protobuf_tests
 from .protobuf_tests.proto import test_pb2
 
@@ -98,3 +106,217 @@ class TestProtobuf(object):
         expected = protobuf_tests.SimpleTest(1)
         assert msg == expected
         assert msg.class_field == 'class_field_value'
+
+    def test_delta(self):
+        encoder = DeltaEncoder(protobuf_tests.Msg1, keyframe_interval=4)
+        decoder = DeltaDecoder(protobuf_tests.Msg1)
+
+        msgs = [
+            protobuf_tests.DefaultTest(1),
+            protobuf_tests.DefaultTest(1),
+            # kind is not part of the message's fields and is always sent
+            protobuf_tests.AlternativeTest(1),
+            protobuf_tests.DefaultTest(1),
+            protobuf_tests.DefaultTest(1),
+            protobuf_tests.DefaultTest(2),
+        ]
+        for i, msg in enumerate(msgs):
+            data = encoder.serialize(msg, key='peer')
+            # only keyframes are sent in full; other messages carry a sequence number even if all fields changed
+            full = i in {0, 4}
+            assert (data == protobuf_tests.Msg1.serialize(msg)) == full
+            if not full:
+                assert data.startswith(b'\x00')
+                with pytest.raises(ValueError):
+                    protobuf_tests.Msg1.parse(data)
+            assert decoder.parse(data, key='peer') == msg
+
+        # changed fields are sent as usual
+        data = encoder.serialize(protobuf_tests.SimpleTest(1), key='peer')
+        assert decoder.parse(data, key='peer') == protobuf_tests.SimpleTest(1)
+        data = encoder.serialize(protobuf_tests.SimpleTest(2), key='peer')
+        assert decoder.parse(data, key='peer') == protobuf_tests.SimpleTest(2)
+
+        with pytest.raises(ValueError):
+            decoder.parse(b'\x00\x01\x01\x00', key='peer')
+
+        # state is kept per key
+        data = encoder.serialize(protobuf_tests.SimpleTest(2), key='peer')
+        with pytest.raises(ValueError):
+            decoder.parse(data, key='other')
+        decoder.reset('peer')
+        with pytest.raises(ValueError):
+            decoder.parse(data, key='peer')
+        encoder.reset('peer')
+        data = encoder.serialize(protobuf_tests.SimpleTest(2), key='peer')
+        assert decoder.parse(data, key='peer') == protobuf_tests.SimpleTest(2)
+
+        with pytest.raises(ValueError):
+            protobuf_tests.Msg1.parse(b'\x00\xff')
+
+    def test_delta_lost_message(self):
+        encoder = DeltaEncoder(protobuf_tests.Msg1)
+        decoder = DeltaDecoder(protobuf_tests.Msg1)
+
+        assert decoder.parse(encoder.serialize(protobuf_tests.SimpleTest(1))) == protobuf_tests.SimpleTest(1)
+        encoder.serialize(protobuf_tests.SimpleTest(2))
+        # the lost message's field would otherwise be restored from stale state
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                decoder.parse(encoder.serialize(protobuf_tests.SimpleTest(2)))
+
+        # the next keyframe resynchronizes the decoder
+        encoder.reset()
+        for _ in range(2):
+            assert decoder.parse(encoder.serialize(protobuf_tests.SimpleTest(2))) == protobuf_tests.SimpleTest(2)
+
+    def test_compression(self):
+        compression = Compression(threshold=100)
+        container = ContainerMessage(test_pb2.TestMessage1, compression=compression)
+        container.parse_fns.update(protobuf_tests.Msg1.parse_fns)
+
+        small = protobuf_tests.BlobTest(b'x' * 10)
+        assert container.serialize(small) == protobuf_tests.Msg1.serialize(small)
+
+        large = protobuf_tests.BlobTest(b'x' * 1000)
+        data = container.serialize(large)
+        assert data.startswith(b'\x00') and len(data) < 100
+        assert container.parse(data) == large
+        # decompression doesn't depend on the receiver's configuration
+        assert protobuf_tests.Msg1.parse(data) == large
+
+        incompressible = protobuf_tests.BlobTest(bytes(range(256)))
+        assert container.serialize(incompressible) == protobuf_tests.Msg1.serialize(incompressible)
+
+        stats = compression.stats
+        assert (stats.compressed, stats.skipped, stats.decompressed) == (1, 1, 1)
+        sizes = [len(protobuf_tests.Msg1.serialize(msg)) for msg in (large, incompressible)]
+        assert stats.bytes_in == sum(sizes)
+        assert 0 < stats.ratio < 1
+        assert stats.compress_time > 0 and stats.decompress_time > 0
+
+        # other codecs
+        container.compression = Compression(LZMA, threshold=100)
+        assert protobuf_tests.Msg1.parse(container.serialize(large)) == large
+
+        best = Codec(200, 'zlib-9', lambda data: zlib.compress(data, 9), zlib.decompress)
+        container.compression = Compression(best, threshold=100)
+        data = container.serialize(large)
+        for invalid in (data, b'\x00\x02'):
+            with pytest.raises(ValueError):
+                protobuf_tests.Msg1.parse(invalid)
+        register_codec(best)
+        try:
+            with pytest.raises(ValueError):
+                register_codec(Codec(200, 'other', bytes, bytes))
+            assert protobuf_tests.Msg1.parse(data) == large
+        finally:
+            del codecs[200]
+
+        # compression applies to deltas as well
+        container.compression = compression
+        encoder, decoder = DeltaEncoder(container), DeltaDecoder(protobuf_tests.Msg1)
+        for _ in range(2):
+            assert decoder.parse(encoder.serialize(large)) == large
+
+    def test_fixed_layout(self):
+        msg = protobuf_tests.FixedTest(1, 0.5, True)
+        # protobuf is used unless fixed layouts are enabled
+        data = protobuf_tests.Msg1.serialize(msg)
+        assert not data.startswith(b'\x00')
+
+        protobuf_tests.Msg1.fixed_layouts = True
+        try:
+            data = protobuf_tests.Msg1.serialize(msg)
+            assert data == b'\x00\x03\x04\x00\x01\x00\x00\x00\x00\x3f\x01'
+            assert protobuf_tests.Msg1.parse(data) == msg
+            assert DeltaDecoder(protobuf_tests.Msg1).parse(data) == msg
+
+            # values that don't fit the layout fall back to protobuf
+            large = protobuf_tests.FixedTest(70000, 0.5, True)
+            data = protobuf_tests.Msg1.serialize(large)
+            assert not data.startswith(b'\x00')
+            assert protobuf_tests.Msg1.parse(data) == large
+
+            # the layout packs the proto's values, where a huge float already became infinity
+            huge = protobuf_tests.FixedTest(1, 1e300, True)
+            data = protobuf_tests.Msg1.serialize(huge)
+            assert data.startswith(b'\x00\x03')
+            assert protobuf_tests.Msg1.parse(data) == protobuf_tests.FixedTest(1, float('inf'), True)
+
+            # messages without layout are not affected
+            data = protobuf_tests.Msg1.serialize(protobuf_tests.SimpleTest(1))
+            assert protobuf_tests.Msg1.parse(data) == protobuf_tests.SimpleTest(1)
+        finally:
+            protobuf_tests.Msg1.fixed_layouts = False
+
+        for invalid in (b'\x00\x03\x04', b'\x00\x03\x04\x00\x01', b'\x00\x03\x04\x00\x01\x00\x00\x00\x00\x3f\x01\x00'):
+            with pytest.raises(ValueError):
+                protobuf_tests.Msg1.parse(invalid)
+        with pytest.raises(ValueError):
+            protobuf_tests.Msg2.parse(b'\x00\x03\x04\x00\x01\x00\x00\x00\x00\x3f\x01')
+        with pytest.raises(ValueError):
+            message(test_pb2.FixedTest, 'fixed_test', layout='<Hf')
+
+        # the layout must hold every proto field, as it is filled from and into the proto
+        container = ContainerMessage(test_pb2.TestMessage1, fixed_layouts=True)
+        with pytest.raises(ValueError):
+            container.message(test_pb2.FixedTest, 'fixed_test', fields=('x', 'y'), layout='<Hf')
+
+        # attributes don't need to match the proto fields, as the message's own (de)serialization is used
+        @container.message(test_pb2.FixedTest, 'fixed_test', layout='<Hf?')
+        @dataclass(frozen=True)
+        class Command(Message, SimpleMessageMixin):
+            port: int
+            power: float
+            on: bool
+
+            @classmethod
+            def _parse(cls, msg: test_pb2.FixedTest) -> 'Command':
+                return cls(msg.x, msg.y, msg.flag)
+
+            def _serialize(self, msg: test_pb2.FixedTest) -> None:
+                msg.x = self.port
+                msg.y = self.power
+                msg.flag = self.on
+
+        data = container.serialize(Command(1, 0.5, True))
+        assert data == b'\x00\x03\x04\x00\x01\x00\x00\x00\x00\x3f\x01'
+        assert container.parse(data) == Command(1, 0.5, True)
+
+        # a standalone message decorator can't register the layout with a container
+        with pytest.raises(ValueError):
+            @message(test_pb2.FixedTest, 'fixed_test', layout='<Hf?')
+            class StandaloneFixedTest(Message):
+                pass
+
+    def test_columnar(self):
+        import numpy as np
+        from hedgehog.utils.protobuf import columnar
+
+        msgs = [protobuf_tests.SimpleTest(i) for i in range(5)]
+        assert columnar.dtype(protobuf_tests.SimpleTest) == np.dtype([('field', '<u4')])
+
+        columns = columnar.to_columns(protobuf_tests.SimpleTest, msgs)
+        assert columns['field'].tolist() == [0, 1, 2, 3, 4]
+
+        array = columnar.to_array(protobuf_tests.SimpleTest, msgs)
+        assert array['field'].sum() == 10
+        assert columnar.from_array(protobuf_tests.SimpleTest, array) == msgs
+        assert columnar.from_columns(protobuf_tests.SimpleTest, columns) == msgs
+
+        payloads = [msg.serialize() for msg in msgs]
+        assert columnar.parse_columns(protobuf_tests.SimpleTest, payloads)['field'].tolist() == [0, 1, 2, 3, 4]
+        assert (columnar.parse_array(protobuf_tests.SimpleTest, payloads) == array).all()
+
+        # the kind field is not part of the message's fields, but selects the type in the parse function
+        msgs = [protobuf_tests.AlternativeTest(i) for i in range(3)]
+        parse_fn = protobuf_tests.Msg1.parse_fns['test']
+        array = columnar.parse_array(protobuf_tests.AlternativeTest, [msg.serialize() for msg in msgs], parse_fn)
+        assert array.dtype.names == ('field',)
+        assert columnar.from_array(protobuf_tests.AlternativeTest, array) == msgs
+
+        with pytest.raises(TypeError):
+            columnar.parse_array(protobuf_tests.AlternativeTest, [msg.serialize() for msg in msgs])
+        with pytest.raises(ValueError):
+            columnar.parse_array(protobuf_tests.AlternativeTest, [protobuf_tests.DefaultTest(1).serialize()], parse_fn)
@@ -0,0 +1,34 @@
+import pytest
+from hedgehog.utils.test_utils import event_loop
+
+import asyncio
+import socket
+
+
+# Pytest fixtures
+event_loop
+
+
+@pytest.mark.asyncio
+async def test_time_steps(event_loop):
+    with event_loop.assert_cleanup_steps([1, 0, 2, 0]):
+        await asyncio.sleep(1)
+        await asyncio.sleep(2)
+
+
+@pytest.mark.asyncio
+async def test_pending_events(event_loop):
+    r, w = socket.socketpair()
+    with r, w:
+        r.setblocking(False)
+        timer = asyncio.ensure_future(asyncio.sleep(5))
+        recv = asyncio.ensure_future(event_loop.sock_recv(r, 1))
+        await asyncio.sleep(0)
+
+        with event_loop.assert_cleanup_steps([0, 0]):
+            w.send(b'x')
+            assert await recv == b'x'
+        assert event_loop.time() == 0
+
+        await timer
+        assert event_loop.time() == 5
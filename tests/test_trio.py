@@ -0,0 +1,117 @@
+import pytest
+from hedgehog.utils.test_utils import zmq_trio_ctx, assertPassed, assertImmediate
+
+import trio
+import trio_asyncio
+import zmq
+
+from hedgehog.utils.trio import stream_from_channel, batches_from_channel, stream_from_socket, batches_from_socket, \
+    buffered
+
+
+# Pytest fixtures
+zmq_trio_ctx
+
+
+async def collect(stream):
+    return [item async for item in stream]
+
+
+@pytest.mark.trio
+async def test_stream_from_channel(autojump_clock):
+    with assertImmediate():
+        send, receive = trio.open_memory_channel(10)
+        for i in range(3):
+            await send.send(i)
+        await send.aclose()
+        assert await collect(stream_from_channel(receive)) == [0, 1, 2]
+
+
+@pytest.mark.trio
+async def test_stream_from_channel_eof(autojump_clock):
+    with assertImmediate():
+        EOF = object()
+        send, receive = trio.open_memory_channel(10)
+        for item in (3, 2, EOF, 1):
+            await send.send(item)
+        assert await collect(stream_from_channel(receive, EOF, use_is=True)) == [3, 2]
+        assert receive.receive_nowait() == 1
+
+
+@pytest.mark.trio
+async def test_batches_from_channel(autojump_clock):
+    send, receive = trio.open_memory_channel(10)
+    for i in range(5):
+        send.send_nowait(i)
+
+    batches = []
+
+    async def consume():
+        async for batch in batches_from_channel(receive, max_batch=3):
+            batches.append(batch)
+
+    with assertPassed(1):
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(consume)
+            await trio.sleep(1)
+            assert batches == [[0, 1, 2], [3, 4]]
+            for item in (5, None, 6):
+                send.send_nowait(item)
+            await send.aclose()
+    assert batches == [[0, 1, 2], [3, 4], [5, None, 6]]
+
+    send, receive = trio.open_memory_channel(10)
+    for item in (0, 1, None, 2):
+        await send.send(item)
+    assert await collect(batches_from_channel(receive, None)) == [[0, 1]]
+    assert receive.receive_nowait() == 2
+    for item in (None, 3):
+        await send.send(item)
+    assert await collect(batches_from_channel(receive, None)) == []
+    assert receive.receive_nowait() == 3
+
+
+@pytest.mark.trio
+async def test_buffered(autojump_clock):
+    produced = []
+
+    async def numbers():
+        for i in range(5):
+            produced.append(i)
+            yield i
+
+    async with buffered(numbers(), 2) as channel:
+        await trio.sleep(1)
+        # two items are buffered, one is held by the producer waiting for buffer space
+        assert produced == [0, 1, 2]
+        assert await collect(channel) == [0, 1, 2, 3, 4]
+
+    async with buffered(numbers()) as channel:
+        assert await channel.receive() == 0
+
+    async with buffered(numbers()) as channel:
+        await channel.aclose()
+
+
+@pytest.mark.trio
+async def test_socket_streams(zmq_trio_ctx, autojump_clock):
+    async with trio_asyncio.open_loop():
+        a, b = (zmq_trio_ctx.socket(zmq.PAIR).configure(hwm=1000, linger=0) for _ in range(2))
+        with a, b:
+            a.bind('inproc://endpoint')
+            b.connect('inproc://endpoint')
+
+            for i in range(3):
+                await a.send_multipart((b'msg', str(i).encode()))
+            await a.send_multipart((b'eof',))
+            assert await collect(stream_from_socket(b, (b'eof',))) == [[b'msg', b'0'], [b'msg', b'1'], [b'msg', b'2']]
+
+            for i in range(3):
+                await a.send_multipart((b'msg', str(i).encode()))
+            await a.send_multipart((b'eof',))
+            await a.send_multipart((b'msg', b'3'))
+            assert await collect(batches_from_socket(b, (b'eof',), max_batch=2)) == [
+                [[b'msg', b'0'], [b'msg', b'1']],
+                [[b'msg', b'2']],
+            ]
+            assert await b.recv_multipart() == [b'msg', b'3']
@@ -4,6 +4,8 @@ from hedgehog.utils.test_utils import event_loop, zmq_aio_ctx, assertTimeout, as
 from hedgehog.utils.test_utils import zmq_trio_ctx, assertTimeoutTrio
 
 import asyncio
+import math
+import trio
 import trio_asyncio
 import zmq
 
@@ -17,12 +19,19 @@ def do_test_socket_configure(socket):
     assert socket.getsockopt(zmq.RCVTIMEO) == -1
     assert socket.getsockopt(zmq.SNDTIMEO) == -1
     assert socket.getsockopt(zmq.LINGER) == -1
+    assert socket.getsockopt(zmq.HEARTBEAT_IVL) == 0
+    assert socket.getsockopt(zmq.HEARTBEAT_TIMEOUT) == -1
+    assert socket.getsockopt(zmq.HEARTBEAT_TTL) == 0
 
-    socket.configure(hwm=2000, rcvtimeo=100, sndtimeo=100, linger=0)
+    socket.configure(hwm=2000, rcvtimeo=100, sndtimeo=100, linger=0,
+                     heartbeat_ivl=100, heartbeat_timeout=300, heartbeat_ttl=1000)
     assert socket.get_hwm() == 2000
     assert socket.getsockopt(zmq.RCVTIMEO) == 100
     assert socket.getsockopt(zmq.SNDTIMEO) == 100
     assert socket.getsockopt(zmq.LINGER) == 0
+    assert socket.getsockopt(zmq.HEARTBEAT_IVL) == 100
+    assert socket.getsockopt(zmq.HEARTBEAT_TIMEOUT) == 300
+    assert socket.getsockopt(zmq.HEARTBEAT_TTL) == 1000
 
 
 class TestSocket(object):
@@ -78,6 +87,252 @@ class TestAsyncSocket(object):
                 await a.send_multipart((b'foo', b'bar'))
                 await task
 
+    @pytest.mark.asyncio
+    async def test_async_merge(self, zmq_aio_ctx):
+        from aiostream import stream
+        from hedgehog.utils.zmq.asyncio import merge
+
+        pairs = [tuple(zmq_aio_ctx.socket(zmq.PAIR).configure(hwm=1000, linger=0) for _ in range(2)) for _ in range(3)]
+        for i, (a, b) in enumerate(pairs):
+            a.bind(f'inproc://endpoint{i}')
+            b.connect(f'inproc://endpoint{i}')
+        (a1, b1), (a2, b2), (a3, b3) = pairs
+        try:
+            for a, count in [(a1, 3), (a2, 1), (a3, 2)]:
+                for j in range(count):
+                    await a.send_multipart((b'msg', str(j).encode()))
+
+            sockets = [b1, b2, b3]
+            items = await stream.list(merge(*sockets, batch=2)[:6])
+            assert [(sockets.index(socket), frames[1]) for socket, frames in items] == [
+                (0, b'0'), (0, b'1'), (1, b'0'), (2, b'0'), (2, b'1'), (0, b'2'),
+            ]
+        finally:
+            for a, b in pairs:
+                a.close()
+                b.close()
+
+    @pytest.mark.asyncio
+    async def test_send_pipeline(self, zmq_aio_ctx):
+        from hedgehog.utils.zmq.asyncio import SendPipeline
+
+        a, b = (zmq_aio_ctx.socket(zmq.PAIR).configure(hwm=1000, linger=0) for _ in range(2))
+        with a, b:
+            a.bind('inproc://endpoint')
+            b.connect('inproc://endpoint')
+
+            async with SendPipeline(a, max_batch=3, max_delay=1) as pipeline:
+                # the batch is sent after the window expired
+                with assertPassed(1):
+                    await pipeline.send_multipart((b'foo', b'1'))
+                    await b.recv_multipart_expect((b'foo', b'1'))
+
+                # a full batch or flushing doesn't wait for the window
+                with assertPassed(0):
+                    for i in range(3):
+                        await pipeline.send_multipart((b'foo', str(i).encode()))
+                    for i in range(3):
+                        await b.recv_multipart_expect((b'foo', str(i).encode()))
+
+                    await pipeline.send_multipart((b'bar',))
+                    await pipeline.flush()
+                    await b.recv_multipart_expect((b'bar',))
+
+                # flushing an empty pipeline doesn't affect the next batch
+                with assertPassed(1):
+                    await pipeline.flush()
+                    await pipeline.send_multipart((b'baz',))
+                    await b.recv_multipart_expect((b'baz',))
+
+                async def producer(name):
+                    for i in range(5):
+                        await pipeline.send_multipart((name, str(i).encode()))
+
+                await asyncio.gather(producer(b'a'), producer(b'b'))
+                await pipeline.flush()
+                received = [await b.recv_multipart() for _ in range(10)]
+                for name in (b'a', b'b'):
+                    assert [i for n, i in received if n == name] == [str(i).encode() for i in range(5)]
+
+            with pytest.raises(RuntimeError):
+                await SendPipeline(a).send_multipart((b'foo',))
+
+    @pytest.mark.asyncio
+    async def test_send_pipeline_backpressure(self, zmq_aio_ctx):
+        from hedgehog.utils.zmq.asyncio import SendPipeline
+
+        a, b = (zmq_aio_ctx.socket(zmq.PAIR).configure(hwm=1, linger=0) for _ in range(2))
+        with a, b:
+            a.bind('inproc://endpoint')
+            b.connect('inproc://endpoint')
+
+            async with SendPipeline(a, max_batch=1, max_queued=2) as pipeline:
+                # two messages fit into the socket, one is held by the flusher, two are queued
+                with assertPassed(0):
+                    for i in range(5):
+                        await pipeline.send_multipart((str(i).encode(),))
+                        await asyncio.sleep(0)
+
+                with assertPassed(1):
+                    task = asyncio.ensure_future(pipeline.send_multipart((b'5',)))
+                    await assertTimeout(task, 1, shield=True)
+                    await b.recv_multipart_expect((b'0',))
+                    await task
+
+                for i in range(1, 6):
+                    await b.recv_multipart_expect((str(i).encode(),))
+
+    @pytest.mark.asyncio
+    async def test_send_pipeline_flusher_error(self, zmq_aio_ctx):
+        from hedgehog.utils.zmq.asyncio import SendPipeline
+
+        # without a peer, the flusher waits for the socket to become writable
+        with zmq_aio_ctx.socket(zmq.PAIR).configure(hwm=1, linger=0) as a:
+            with pytest.raises(RuntimeError):
+                async with SendPipeline(a, max_batch=1, max_queued=1) as pipeline:
+                    await pipeline.send_multipart((b'0',))
+                    await asyncio.sleep(0)
+                    await pipeline.send_multipart((b'1',))
+
+                    # closing the socket stops the flusher, which must not leave the waiting sender hanging
+                    task = asyncio.ensure_future(pipeline.send_multipart((b'2',)))
+                    await assertTimeout(task, 1, shield=True)
+                    a.close()
+                    await task
+
+    @pytest.mark.asyncio
+    async def test_dual_lane_socket(self, zmq_aio_ctx):
+        from hedgehog.utils.zmq.asyncio import DualLaneSocket
+
+        sockets = [zmq_aio_ctx.socket(zmq.PAIR).configure(hwm=1000, linger=0) for _ in range(4)]
+        control_a, control_b, bulk_a, bulk_b = sockets
+        control_a.bind('inproc://control')
+        control_b.connect('inproc://control')
+        bulk_a.bind('inproc://bulk')
+        bulk_b.connect('inproc://bulk')
+        try:
+            a = DualLaneSocket(control_a, bulk_a, chunk_size=4)
+            b = DualLaneSocket(control_b, bulk_b, chunk_size=4)
+
+            payload = (b'foo', bytes(range(20)), b'')
+            await a.send_bulk(payload)
+            await a.send_bulk(())
+            await a.send_control((b'stop',))
+
+            # the control message overtakes the queued bulk messages
+            with assertPassed(0):
+                assert await b.recv_multipart() == (DualLaneSocket.CONTROL, [b'stop'])
+                assert await b.recv_multipart() == (DualLaneSocket.BULK, list(payload))
+                assert await b.recv_multipart() == (DualLaneSocket.BULK, [])
+
+            # sending bulk data yields to other tasks between chunks
+            order = []
+
+            async def send_bulk():
+                await a.send_bulk((bytes(100),))
+                order.append('bulk')
+
+            async def send_control():
+                await a.send_control((b'stop',))
+                order.append('control')
+
+            await asyncio.gather(send_bulk(), send_control())
+            assert order == ['control', 'bulk']
+
+            with assertPassed(1):
+                task = asyncio.ensure_future(b.recv_multipart())
+                await asyncio.sleep(1)
+                await a.send_control((b'go',))
+                assert await task == (DualLaneSocket.CONTROL, [b'stop'])
+                assert await b.recv_multipart() == (DualLaneSocket.CONTROL, [b'go'])
+                assert await b.recv_multipart() == (DualLaneSocket.BULK, [bytes(100)])
+        finally:
+            for socket in sockets:
+                socket.close()
+
+    @pytest.mark.asyncio
+    async def test_dual_lane_control_latency(self, zmq_aio_ctx):
+        from hedgehog.utils.zmq.asyncio import DualLaneSocket
+
+        sockets = [zmq_aio_ctx.socket(zmq.PAIR).configure(hwm=1000, linger=0) for _ in range(4)]
+        control_a, control_b, bulk_a, bulk_b = sockets
+        control_a.bind('inproc://control')
+        control_b.connect('inproc://control')
+        bulk_a.bind('inproc://bulk')
+        bulk_b.connect('inproc://bulk')
+        try:
+            a = DualLaneSocket(control_a, bulk_a, chunk_size=1 << 16)
+            b = DualLaneSocket(control_b, bulk_b, chunk_size=1 << 16)
+
+            # 4 MiB, i.e. 64 chunks
+            payload = bytes(range(256)) * (1 << 14)
+
+            async def send_control():
+                # while the upload is in progress, send control messages tagged with the chunks received so far
+                for i in range(8):
+                    while a.chunks_sent < 8 * i + 4:
+                        await asyncio.sleep(0)
+                    await a.send_control((str(b.chunks_received).encode(),))
+
+            async def receive():
+                latencies = []
+                while True:
+                    lane, frames = await b.recv_multipart()
+                    if lane == DualLaneSocket.BULK:
+                        return latencies, frames
+                    # the control latency, measured in bulk chunks processed by the receiver in the meantime
+                    latencies.append(b.chunks_received - int(frames[0]))
+
+            with assertPassed(0):
+                _, _, (latencies, frames) = await asyncio.gather(
+                    a.send_bulk((payload, b'foo')), send_control(), receive())
+            assert frames == [payload, b'foo']
+            assert a.chunks_sent == b.chunks_received == 65
+            assert len(latencies) == 8
+            assert max(latencies) <= 1
+        finally:
+            for socket in sockets:
+                socket.close()
+
+    @pytest.mark.asyncio
+    async def test_watchdog(self, zmq_aio_ctx):
+        from hedgehog.utils.zmq.asyncio import Watchdog
+
+        a, b = (zmq_aio_ctx.socket(zmq.PAIR).configure(hwm=1000, linger=0) for _ in range(2))
+        with a, b:
+            a.bind('inproc://endpoint')
+            b.connect('inproc://endpoint')
+
+            changes = []
+            watchdog = Watchdog(2, on_change=changes.append)
+            # before the watchdog is started, there is no time since the last message
+            watchdog.touch()
+            with pytest.raises(RuntimeError):
+                watchdog.since_last_message
+
+            async with watchdog:
+                assert watchdog.state == Watchdog.ALIVE
+
+                await asyncio.sleep(1.5)
+                await a.signal()
+                assert await watchdog.recv_multipart(b) == [b'']
+                assert watchdog.since_last_message == 0
+
+                await asyncio.sleep(1.5)
+                assert watchdog.state == Watchdog.ALIVE
+                assert watchdog.since_last_message == 1.5
+
+                # the peer is declared dead exactly after the timeout
+                await asyncio.sleep(0.5)
+                assert watchdog.state == Watchdog.DEAD
+                assert changes == [Watchdog.DEAD]
+
+                await asyncio.sleep(10)
+                watchdog.touch()
+                assert watchdog.state == Watchdog.ALIVE
+                await asyncio.sleep(2.5)
+                assert changes == [Watchdog.DEAD, Watchdog.ALIVE, Watchdog.DEAD]
+
 
 class TestTrioSocket(object):
     @pytest.mark.trio
@@ -110,3 +365,496 @@ class TestTrioSocket(object):
                         await b.recv_multipart_expect((b'foo', b'bar'))
                     await a.send_multipart((b'foo', b'bar'))
                     await b.recv_multipart_expect((b'foo', b'bar'))
+
+    @pytest.mark.trio
+    async def test_trio_send_pipeline(self, zmq_trio_ctx, autojump_clock):
+        from hedgehog.utils.zmq.trio import SendPipeline
+
+        async with trio_asyncio.open_loop():
+            a, b = (zmq_trio_ctx.socket(zmq.PAIR).configure(hwm=1000, linger=0) for _ in range(2))
+            with a, b:
+                a.bind('inproc://endpoint')
+                b.connect('inproc://endpoint')
+
+                async with SendPipeline(a, max_delay=1) as pipeline:
+                    with assertPassed(0):
+                        await pipeline.send_multipart((b'foo', b'bar'))
+                        await pipeline.flush()
+                        await b.recv_multipart_expect((b'foo', b'bar'))
+
+                    await pipeline.send_multipart((b'baz',))
+                await b.recv_multipart_expect((b'baz',))
+
+    @pytest.mark.trio
+    async def test_trio_dual_lane_socket(self, zmq_trio_ctx, autojump_clock):
+        from hedgehog.utils.zmq.trio import DualLaneSocket
+
+        async with trio_asyncio.open_loop():
+            sockets = [zmq_trio_ctx.socket(zmq.PAIR).configure(hwm=1000, linger=0) for _ in range(4)]
+            control_a, control_b, bulk_a, bulk_b = sockets
+            control_a.bind('inproc://control')
+            control_b.connect('inproc://control')
+            bulk_a.bind('inproc://bulk')
+            bulk_b.connect('inproc://bulk')
+            try:
+                a = DualLaneSocket(control_a, bulk_a, chunk_size=4)
+                b = DualLaneSocket(control_b, bulk_b, chunk_size=4)
+
+                await a.send_bulk((b'foo', bytes(10)))
+                await a.send_control((b'stop',))
+                assert await b.recv_multipart() == (DualLaneSocket.CONTROL, [b'stop'])
+                assert await b.recv_multipart() == (DualLaneSocket.BULK, [b'foo', bytes(10)])
+            finally:
+                for socket in sockets:
+                    socket.close()
+
+    @pytest.mark.trio
+    async def test_trio_watchdog(self, zmq_trio_ctx, autojump_clock):
+        from hedgehog.utils.zmq.trio import Watchdog
+
+        async with trio_asyncio.open_loop():
+            a, b = (zmq_trio_ctx.socket(zmq.PAIR).configure(hwm=1000, linger=0) for _ in range(2))
+            with a, b:
+                a.bind('inproc://endpoint')
+                b.connect('inproc://endpoint')
+
+                async with Watchdog(2) as watchdog:
+                    await a.signal()
+                    assert await watchdog.recv_multipart(b) == [b'']
+                    assert watchdog.state == Watchdog.ALIVE
+                    await trio.sleep(3)
+                    assert watchdog.state == Watchdog.DEAD
+
+    @pytest.mark.trio
+    async def test_trio_merge(self, zmq_trio_ctx, autojump_clock):
+        from hedgehog.utils.zmq.trio import merge
+
+        async with trio_asyncio.open_loop():
+            pairs = [tuple(zmq_trio_ctx.socket(zmq.PAIR).configure(hwm=1000, linger=0) for _ in range(2))
+                     for _ in range(2)]
+            for i, (a, b) in enumerate(pairs):
+                a.bind(f'inproc://endpoint{i}')
+                b.connect(f'inproc://endpoint{i}')
+            (a1, b1), (a2, b2) = pairs
+            try:
+                for a, count in [(a1, 2), (a2, 2)]:
+                    for j in range(count):
+                        await a.send_multipart((b'msg', str(j).encode()))
+
+                items = []
+                async for socket, frames in merge(b1, b2):
+                    items.append((socket is b1, frames[1]))
+                    if len(items) == 4:
+                        break
+                assert items == [(True, b'0'), (False, b'0'), (True, b'1'), (False, b'1')]
+            finally:
+                for a, b in pairs:
+                    a.close()
+                    b.close()
+
+
+class TestSharedMemoryChannel(object):
+    def test_shm_channel(self, zmq_ctx):
+        from hedgehog.utils.zmq.shm import SharedMemoryChannel, SharedPayload, MAGIC
+
+        a, b = (zmq_ctx.socket(zmq.PAIR).configure(hwm=1000, linger=0) for _ in range(2))
+        with a, b, \
+                SharedMemoryChannel.for_endpoint('inproc://endpoint', threshold=16, slot_size=64, slots=2) as sender, \
+                SharedMemoryChannel() as receiver:
+            a.bind('inproc://endpoint')
+            b.connect('inproc://endpoint')
+
+            small, large, huge = b'foo', bytes(range(32)), bytes(128)
+
+            frames = sender.pack((small, large))
+            assert frames[0] == MAGIC and frames[2:] == [small, b'']
+            a.send_multipart(frames)
+            assert receiver.unpack(b.recv_multipart()) == [small, large]
+
+            # frames that don't fit a slot are sent inline
+            assert sender.pack((small, huge)) == [small, huge]
+
+            a.send_multipart(sender.pack((large,)))
+            a.send_multipart(sender.pack((large,)))
+            first, = receiver.unpack(b.recv_multipart(), copy=False)
+            second, = receiver.unpack(b.recv_multipart(), copy=False)
+            assert isinstance(first, SharedPayload) and bytes(first) == large
+
+            # both slots are in use, so the ring is full
+            assert sender.pack((large,)) == [large]
+
+            first.acquire()
+            first.release()
+            assert sender.pack((large,)) == [large]
+            first.release()
+            with pytest.raises(RuntimeError):
+                first.release()
+            second.release()
+
+            # released slots are reused
+            assert sender.pack((large, large))[0] == MAGIC
+            assert sender.pack((large,)) == [large]
+
+    def test_shm_channel_reclaim(self):
+        from hedgehog.utils.zmq.shm import SharedMemoryChannel, MAGIC
+
+        time = 0.0
+        large = bytes(range(32))
+        with SharedMemoryChannel(threshold=16, slot_size=64, slots=1, reclaim_timeout=10,
+                                 clock=lambda: time) as sender, \
+                SharedMemoryChannel() as receiver:
+            # the message is dropped, so its slot is never released
+            dropped = sender.pack((large,))
+            assert sender.pack((large,)) == [large]
+
+            # after the timeout, the slot is reclaimed and its generation advances
+            time = 10
+            frames = sender.pack((large,))
+            assert frames[1] != dropped[1]
+            with pytest.raises(RuntimeError):
+                receiver.unpack(dropped)
+
+            payload, = receiver.unpack(frames, copy=False)
+            assert payload.valid
+            time = 20
+            assert sender.pack((bytes(32),))[0] == MAGIC
+            assert not payload.valid
+            with pytest.raises(RuntimeError):
+                bytes(payload)
+
+            # a late release doesn't free the slot for the new generation
+            payload.release()
+            assert not sender.buffer.is_free(0)
+            assert sender.pack((large,)) == [large]
+
+    def test_shm_channel_invalid(self):
+        from hedgehog.utils.zmq.shm import SharedMemoryChannel, MAGIC, _DESCRIPTOR_HEADER, _DESCRIPTOR_ENTRY
+
+        with pytest.raises(ValueError):
+            SharedMemoryChannel.for_endpoint('inproc://endpoint', zmq.PUB)
+        SharedMemoryChannel.for_endpoint('inproc://endpoint', zmq.PUSH).close()
+
+        with SharedMemoryChannel(threshold=16, slot_size=64, slots=2) as sender, SharedMemoryChannel() as receiver:
+            sender.pack((bytes(32),))
+            path = sender.buffer.path.encode()
+
+            def descriptor(*entry):
+                return _DESCRIPTOR_HEADER.pack(len(path)) + path + _DESCRIPTOR_ENTRY.pack(*entry)
+
+            for entry in [(0, 2, 32, 1), (0, 0, 65, 1), (1, 0, 32, 1)]:
+                with pytest.raises(ValueError):
+                    receiver.unpack([MAGIC, descriptor(*entry), b''])
+            for invalid in [b'', b'\x00', descriptor(0, 0, 32, 1)[:-1], _DESCRIPTOR_HEADER.pack(len(path) + 1) + path]:
+                with pytest.raises(ValueError):
+                    receiver.unpack([MAGIC, invalid, b''])
+            assert receiver.unpack([MAGIC, descriptor(0, 0, 32, 1), b'']) == [bytes(32)]
+
+            # large frames that are not markers are passed through
+            assert receiver.unpack([bytes(1000), b'foo']) == [bytes(1000), b'foo']
+
+    def test_shm_channel_remote(self):
+        from hedgehog.utils.zmq.shm import SharedMemoryChannel
+
+        with SharedMemoryChannel.for_endpoint('tcp://127.0.0.1:10789', threshold=0) as channel:
+            assert not channel.enabled
+            assert channel.pack((b'foo',)) == [b'foo']
+            assert channel.unpack([b'foo']) == [b'foo']
+
+
+class TestRecorder(object):
+    def test_record(self, zmq_ctx, tmp_path):
+        from hedgehog.utils.zmq.recorder import Recorder, Recording, Entry, replay
+
+        path = str(tmp_path / 'traffic.log')
+        a, b = (zmq_ctx.socket(zmq.PAIR).configure(hwm=1000, linger=0) for _ in range(2))
+        with a, b:
+            a.bind('inproc://endpoint')
+            b.connect('inproc://endpoint')
+
+            with Recorder(path, discriminator=lambda frames: frames[0], clock=iter(range(10)).__next__,
+                          chunk_size=16) as recorder:
+                for msg in [(b'foo', b'1'), (b'bar', b'2'), (b'foo', b'3')]:
+                    a.send_multipart(msg)
+                    assert recorder.recv_multipart(b) == list(msg)
+                recorder.record([b'bar', b''], timestamp=10)
+
+            with Recording(path) as recording:
+                assert len(recording) == 4
+                assert recording[0] == Entry(0, b'foo', [b'foo', b'1'])
+                assert recording.seek(1.5) == 2
+                assert [entry.timestamp for entry in recording.entries(start=1, end=10)] == [1, 2]
+                assert [entry.frames[1] for entry in recording.entries(discriminator=b'bar')] == [b'2', b'']
+                assert [entry.frames[1] for entry in recording.entries(start=1, discriminator=b'foo')] == [b'3']
+                assert list(recording.entries(discriminator=b'baz')) == []
+
+                time = 0.0
+
+                def sleep(delay):
+                    nonlocal time
+                    time += delay
+
+                assert replay(recording, a, speed=2, clock=lambda: time, sleep=sleep, end=10) == 3
+                assert time == 1
+                for msg in [(b'foo', b'1'), (b'bar', b'2'), (b'foo', b'3')]:
+                    b.recv_multipart_expect(msg)
+
+        with open(path, 'wb') as f:
+            f.write(b'garbage')
+        with pytest.raises(ValueError):
+            Recording(path)
+
+    @pytest.mark.asyncio
+    async def test_replay_async(self, zmq_aio_ctx, tmp_path):
+        from hedgehog.utils.zmq.recorder import Recorder, Recording, replay_async
+
+        path = str(tmp_path / 'traffic.log')
+        with Recorder(path) as recorder:
+            for timestamp in [5, 6, 8]:
+                recorder.record([str(timestamp).encode()], timestamp=timestamp)
+
+        a, b = (zmq_aio_ctx.socket(zmq.PAIR).configure(hwm=1000, linger=0) for _ in range(2))
+        with a, b, Recording(path) as recording:
+            a.bind('inproc://endpoint')
+            b.connect('inproc://endpoint')
+
+            with assertPassed(3):
+                assert await replay_async(recording, a) == 3
+            with assertPassed(0):
+                assert await replay_async(recording, a, speed=math.inf) == 3
+            for _ in range(2):
+                for timestamp in [5, 6, 8]:
+                    await b.recv_multipart_expect((str(timestamp).encode(),))
+
+
+class TestTracing(object):
+    def test_tracing(self, zmq_ctx):
+        from hedgehog.utils.zmq.tracing import Tracer, Histogram
+
+        clock = iter(range(0, 100, 2)).__next__
+        sender, proxy, receiver = (Tracer(name, clock=clock) for name in ('sender', 'proxy', 'receiver'))
+
+        a, b = (zmq_ctx.socket(zmq.PAIR).configure(hwm=1000, linger=0) for _ in range(2))
+        with a, b:
+            a.bind('inproc://endpoint')
+            b.connect('inproc://endpoint')
+
+            a.send_multipart_traced((b'foo', b'bar'), sender)
+            frames = b.recv_multipart()
+            a.send_multipart(proxy.forward(frames))
+            frames, trace = b.recv_multipart_traced(receiver)
+            assert frames == [b'foo', b'bar']
+            assert [hop.name for hop in trace.hops] == ['sender', 'proxy', 'receiver']
+            assert trace.latencies() == [('sender', 'proxy', 2), ('proxy', 'receiver', 2)]
+            assert receiver.hop_latency['sender', 'proxy'].count == 1
+            assert receiver.end_to_end.max == 4
+
+            # untraced messages pass through
+            a.send_multipart((b'foo',))
+            assert b.recv_multipart_traced(receiver) == ([b'foo'], None)
+
+            # disabled tracers don't add trace frames, but strip them
+            sender.enabled = receiver.enabled = False
+            assert sender.start((b'foo',)) == (b'foo',)
+            a.send_multipart_traced((b'foo',), sender)
+            assert b.recv_multipart() == [b'foo']
+            sender.enabled = True
+            a.send_multipart_traced((b'foo',), sender)
+            assert b.recv_multipart_traced(receiver) == ([b'foo'], None)
+            assert receiver.end_to_end.count == 1
+
+        histogram = Histogram((1, 2, 5))
+        assert histogram.quantile(0.5) == 0
+        for value in (0.5, 1.5, 1.5, 3, 10):
+            histogram.record(value)
+        assert histogram.counts == [1, 2, 1, 1]
+        assert histogram.mean == 3.3
+        assert histogram.quantile(0.5) == 2
+        assert histogram.quantile(1) == 10
+
+    def test_tracing_router_dealer(self, zmq_ctx):
+        from hedgehog.utils.zmq.tracing import Tracer
+
+        client, server = Tracer('client'), Tracer('server')
+
+        router = zmq_ctx.socket(zmq.ROUTER).configure(hwm=1000, linger=0)
+        dealer = zmq_ctx.socket(zmq.DEALER).configure(hwm=1000, linger=0)
+        req = zmq_ctx.socket(zmq.REQ).configure(hwm=1000, linger=0)
+        with router, dealer, req:
+            router.bind('inproc://endpoint')
+            dealer.connect('inproc://endpoint')
+            req.connect('inproc://endpoint')
+
+            # the trace frame is placed after the identity frame added by the ROUTER
+            dealer.send_multipart_traced((b'foo',), client)
+            (identity, *frames), trace = router.recv_multipart_traced(server, envelope=1)
+            assert frames == [b'foo']
+            assert [hop.name for hop in trace.hops] == ['client', 'server']
+
+            router.send_multipart_traced((identity, b'bar'), server, envelope=1)
+            assert dealer.poll(100) == zmq.POLLIN
+            frames, trace = dealer.recv_multipart_traced(client)
+            assert frames == [b'bar']
+            assert [hop.name for hop in trace.hops] == ['server', 'client']
+
+            # REQ peers add an empty delimiter frame to the envelope
+            req.send_multipart_traced((b'foo',), client)
+            (identity, delimiter, *frames), trace = router.recv_multipart_traced(server, envelope=2)
+            assert delimiter == b'' and frames == [b'foo'] and trace is not None
+
+            router.send_multipart(server.forward(server.start((identity, b'', b'bar'), envelope=2), envelope=2))
+            assert req.poll(100) == zmq.POLLIN
+            frames, trace = req.recv_multipart_traced(client)
+            assert frames == [b'bar']
+            assert [hop.name for hop in trace.hops] == ['server', 'server', 'client']
+
+            # frames received without copying are handled as well
+            dealer.send_multipart_traced((b'foo',), client)
+            assert router.poll(100) == zmq.POLLIN
+            (identity, *frames), trace = router.recv_multipart_traced(server, copy=False, envelope=1)
+            assert [frame.bytes for frame in frames] == [b'foo']
+            assert [hop.name for hop in trace.hops] == ['client', 'server']
+
+            router.send_multipart(server.forward([identity, *client.start((b'bar',))], envelope=1))
+            assert dealer.poll(100) == zmq.POLLIN
+            frames, trace = dealer.recv_multipart_traced(client, copy=False)
+            assert [frame.bytes for frame in frames] == [b'bar']
+            assert [hop.name for hop in trace.hops] == ['client', 'server', 'client']
+
+    @pytest.mark.asyncio
+    async def test_async_tracing(self, zmq_aio_ctx):
+        from hedgehog.utils.zmq.tracing import Tracer
+
+        loop = asyncio.get_event_loop()
+        sender, receiver = Tracer('sender', clock=loop.time), Tracer('receiver', clock=loop.time)
+
+        a, b = (zmq_aio_ctx.socket(zmq.PAIR).configure(hwm=1000, linger=0) for _ in range(2))
+        with a, b:
+            a.bind('inproc://endpoint')
+            b.connect('inproc://endpoint')
+
+            await a.send_multipart_traced((b'foo',), sender)
+            await asyncio.sleep(1)
+            frames, trace = await b.recv_multipart_traced(receiver)
+            assert frames == [b'foo']
+            assert trace.total() == 1
+
+
+class TestReactor(object):
+    def test_reactor(self, zmq_ctx):
+        pairs = [tuple(zmq_ctx.socket(zmq.PAIR).configure(hwm=1000, linger=0) for _ in range(2)) for _ in range(2)]
+        try:
+            for i, (a, b) in enumerate(pairs):
+                a.bind(f'inproc://endpoint-{i}')
+                b.connect(f'inproc://endpoint-{i}')
+            (a1, b1), (a2, b2) = pairs
+
+            with zmq_ctx.reactor(batch=2) as reactor:
+                received = []
+                reactor.register(b1, lambda frames: received.append((1, frames)))
+                reactor.register(b2, lambda frames: received.append((2, frames)))
+
+                assert reactor.run_once(0) == 0
+
+                for i in range(5):
+                    a1.send_multipart((b'foo', str(i).encode()))
+                b1.poll(100)
+
+                # at most two messages per socket and poll
+                assert reactor.run_once(1) == 2
+                assert received == [(1, [b'foo', b'0']), (1, [b'foo', b'1'])]
+
+                # the busy socket was served last time, so the other socket comes first
+                a2.send_multipart((b'bar',))
+                b2.poll(100)
+                received.clear()
+                assert reactor.run_once(1) == 3
+                assert received == [(2, [b'bar']), (1, [b'foo', b'2']), (1, [b'foo', b'3'])]
+
+                reactor.unregister(b1)
+                assert reactor.run_once(0) == 0
+                b1.recv_multipart_expect((b'foo', b'4'))
+        finally:
+            for a, b in pairs:
+                a.close()
+                b.close()
+
+    def test_reactor_timers(self, zmq_ctx):
+        import threading
+
+        now = 0.0
+
+        def run_at(time):
+            nonlocal now
+            now = time
+            return reactor.run_once(0)
+
+        with zmq_ctx.reactor(clock=lambda: now) as reactor:
+            ticks = []
+            timer = reactor.call_every(1, lambda: ticks.append('tick'))
+            reactor.call_later(2, lambda: ticks.append('once'))
+
+            assert run_at(0.5) == 0
+            assert ticks == []
+            run_at(1)
+            assert ticks == ['tick']
+            run_at(2)
+            assert ticks == ['tick', 'once', 'tick']
+
+            # a late repeating timer catches up instead of drifting
+            run_at(4.5)
+            assert ticks == ['tick', 'once', 'tick', 'tick', 'tick']
+            run_at(5)
+            assert ticks == ['tick', 'once', 'tick', 'tick', 'tick', 'tick']
+
+            timer.cancel()
+            run_at(10)
+            assert ticks == ['tick', 'once', 'tick', 'tick', 'tick', 'tick']
+
+            # wakeups from other threads interrupt the poll, even without a timer
+            ticks.clear()
+            threads = []
+            for i in range(3):
+                thread = threading.Thread(target=reactor.call_soon_threadsafe, args=(lambda i=i: ticks.append(i),))
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+            reactor.stop()
+            reactor.run()
+            assert sorted(ticks) == [0, 1, 2]
+
+    def test_reactor_many_sockets(self, zmq_ctx):
+        sockets, messages = 4, 20
+
+        pairs = []
+        try:
+            for i in range(sockets):
+                a = zmq_ctx.socket(zmq.PUSH).configure(hwm=messages + 1, linger=0)
+                b = zmq_ctx.socket(zmq.PULL).configure(hwm=messages + 1, linger=0)
+                pairs.append((a, b))
+                a.bind(f'inproc://endpoint-{i}')
+                b.connect(f'inproc://endpoint-{i}')
+                for j in range(messages):
+                    a.send_multipart((str(i).encode(), str(j).encode()))
+
+            received = {i: [] for i in range(sockets)}
+            count = 0
+
+            def handler(frames):
+                nonlocal count
+                received[int(frames[0])].append(int(frames[1]))
+                count += 1
+                if count == sockets * messages:
+                    reactor.stop()
+
+            with zmq_ctx.reactor(batch=8) as reactor:
+                for _, b in pairs:
+                    reactor.register(b, handler)
+                reactor.run()
+
+            # every message arrives, in order per socket; benchmarks/reactor_vs_threads.py compares the speed
+            assert received == {i: list(range(messages)) for i in range(sockets)}
+        finally:
+            for a, b in pairs:
+                a.close()
+                b.close()